@@ -0,0 +1,278 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import matplotlib
+import numpy as np
+import pandas as pd
+
+import main as app
+
+# Number of categories of each kind in the generated workbooks
+SIZES = {'locations': 6, 'foods': 12, 'adults': 8, 'provinces': 10}
+
+# Number of records in the workbooks that list several rows per province
+ROWS = 30
+
+# Order in which the stages are reported
+STAGES = ['startup', 'load', 'load_cached', 'group', 'create_other_category', 'create_other_matrix', 'format',
+          'process', 'render']
+
+
+def names(kind, n):
+    # Name the first adulterant as a contaminant, since that is where the adulterant columns start
+    if kind == 'adulterant':
+        return ['contaminant %d' % i if i == 0 else 'adulterant %d' % i for i in range(n)]
+
+    return ['%s %d' % (kind, i) for i in range(n)]
+
+
+def write(df, folder, name):
+    # Write the workbook the chart functions read
+    df.to_excel(os.path.join(folder, '%s.xlsx' % name), index=False)
+
+
+def generate(folder, locations=SIZES['locations'], foods=SIZES['foods'], adults=SIZES['adults'],
+             provinces=SIZES['provinces'], rows=ROWS, seed=0):
+    rng = np.random.default_rng(seed)
+
+    # Name every category
+    locations = names('location', locations)
+    foods = names('food', foods)
+    adults = names('adulterant', adults)
+    provinces = names('province', provinces)
+
+    # Create the folder for the workbooks
+    os.makedirs(folder, exist_ok=True)
+
+    # Write the percentage of each location, food and adulterant, next to a code naming its category
+    for name, labels, col in [('loc_by_pct', locations, 'perc'), ('food_by_pct', foods, 'perc'),
+                              ('adult_by_pct', adults, 'perc'), ('adult_by_fail', adults, 'perc')]:
+        write(pd.DataFrame({'name': labels, 'code': range(len(labels)), col: rng.random(len(labels)) * 100}),
+              folder, name)
+
+    # Write the failure rate of each food
+    write(pd.DataFrame({'prod_category_english_nn': foods, 'fail_rate': rng.random(len(foods))}), folder,
+          'food_by_fail')
+
+    # Write the recommendations of each province
+    write(pd.DataFrame({'province': provinces, 'code': range(len(provinces)),
+                        'curr_recs': rng.integers(1, 100, len(provinces))}), folder, 'prov_by_recs')
+
+    # Spread the records across the provinces
+    prov = np.resize(provinces, rows)
+
+    # Write the food tests and the new counts of each record
+    write(pd.DataFrame({'data_source_province': prov, 'year': 2020, 'orig_f_perc': rng.random(rows),
+                        'orig_count': rng.integers(0, 50, rows)}), folder, 'prov_by_food_test')
+    write(pd.DataFrame({'data_source_province': prov, 'code': 1, 'new_count': rng.integers(0, 50, rows)}), folder,
+          'prov_by_cnt')
+
+    # Write the counts of each adulterant in each food, leaving about a third of them empty
+    counts = rng.integers(0, 60, (len(foods), len(adults))) * (rng.random((len(foods), len(adults))) > 0.3)
+    df = pd.DataFrame(counts, columns=adults)
+    df.insert(0, 'prod_category_english_nn', foods)
+    write(df, folder, 'food_by_adult')
+
+    # Write the counts of each food and each adulterant in each record
+    df = pd.DataFrame(rng.integers(0, 40, (rows, len(foods) + len(adults))), columns=foods + adults)
+    df.insert(0, 'level_1', prov)
+    write(df, folder, 'prov_by_food_adult')
+
+
+def timed(func, repeat=1, setup=None):
+    best = float('inf')
+
+    # Keep the fastest of the runs, preparing each one first
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+
+    return best
+
+
+def workbooks():
+    # Retrieve every workbook in the data folder
+    return sorted(os.path.join('data', fname) for fname in os.listdir('data') if fname.endswith('.xlsx'))
+
+
+def reset(sidecars=False):
+    # Forget the workbooks read so far
+    app.cache.clear()
+
+    # Remove the columnar copies so the workbooks are parsed again
+    if sidecars:
+        shutil.rmtree(os.path.join('data', app.SIDECAR_DIR), ignore_errors=True)
+
+
+def load_all():
+    # Read every workbook
+    for fname in workbooks():
+        app.read_data(fname)
+
+
+def other_frames():
+    # Prepare the frames of the charts that collapse a column into 'Other'
+    frames = []
+    for func in [app.loc_by_pct, app.food_by_pct, app.adult_by_pct, app.adult_by_fail]:
+        frames.append((app.rename_categories(app.get_data(func)), 'x', 'perc'))
+    frames.append((app.get_data(app.food_by_fail), 'prod_category_english_nn', 'fail_rate'))
+    frames.append((app.rename_categories(app.get_data(app.prov_by_recs)), 'province', 'curr_recs'))
+
+    return frames
+
+
+def other_matrices():
+    model = app.get_model()
+
+    # Retrieve every table the food, adulterant and province charts slice
+    return [(model['food_adult'], model['fa_foods'], 0), (model['food_adult'], model['fa_adults'], 1),
+            (model['prov_food'], model['provinces'], 0), (model['prov_food'], model['foods'], 1),
+            (model['prov_adult'], model['provinces'], 0), (model['prov_adult'], model['adults'], 1)]
+
+
+def startup():
+    # Start the comparison session in a new interpreter and quit at the first prompt
+    subprocess.run([sys.executable, app.__file__, '--compare'], input='q\n', capture_output=True, text=True,
+                   check=True)
+
+
+def run(repeat=3, workers=None, export='png'):
+    stages = {}
+
+    # Time starting the interactive tool until it is ready for input
+    stages['startup'] = timed(startup, repeat)
+
+    # Time parsing every workbook, and reading them back from their columnar copies
+    stages['load'] = timed(load_all, repeat, lambda: reset(True))
+    stages['load_cached'] = timed(load_all, repeat, reset)
+
+    # Time grouping the records by province and building the counts, starting from the parsed workbooks
+    stages['group'] = timed(lambda: (app.get_prov_data(), app.get_model()), repeat, lambda: (reset(), load_all()))
+
+    # Time collapsing small categories into 'Other'
+    frames = other_frames()
+    stages['create_other_category'] = timed(
+        lambda: [app.create_other_category(df.copy(), x, y) for df, x, y in frames], repeat)
+    matrices = other_matrices()
+    stages['create_other_matrix'] = timed(
+        lambda: [app.create_other_matrix(values, labels, axis=axis) for values, labels, axis in matrices], repeat)
+
+    # Time formatting every label, starting from an empty cache
+    stages['format'] = timed(app.label_table, repeat, app.format.cache_clear)
+
+    # Time running the chart functions, then rendering every chart they produce
+    jobs = []
+
+    def process():
+        jobs[:] = app.collect_jobs(app.CHARTS.values())
+
+    stages['process'] = timed(process, repeat)
+    stages['render'] = timed(lambda: app.update_charts(jobs, workers, force=True, export=export), repeat)
+
+    return stages, len(jobs)
+
+
+def benchmark(sizes, rows=ROWS, repeat=3, workers=None, seed=0, keep=None, export='png'):
+    # Work in a folder of its own, since the chart functions read and write relative paths
+    folder = keep or tempfile.mkdtemp(prefix='datavis-bench-')
+    cwd = os.getcwd()
+
+    try:
+        # Generate the workbooks
+        start = time.perf_counter()
+        generate(os.path.join(folder, 'data'), rows=rows, seed=seed, **sizes)
+        generated = time.perf_counter() - start
+
+        os.chdir(folder)
+        try:
+            # Start from nothing cached
+            reset(True)
+            stages, charts = run(repeat, workers, export)
+        finally:
+            os.chdir(cwd)
+            reset()
+    finally:
+        if keep is None:
+            shutil.rmtree(folder, ignore_errors=True)
+
+    return {'sizes': dict(sizes, rows=rows), 'repeat': repeat, 'workers': workers, 'export': export, 'seed': seed,
+            'charts': charts, 'generate': generated, 'stages': stages}
+
+
+def environment():
+    # Record what the timings depend on
+    return {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count(),
+            'numpy': np.__version__, 'pandas': pd.__version__, 'matplotlib': matplotlib.__version__}
+
+
+def compare(old, new):
+    # Match the runs by their sizes
+    runs = {json.dumps(run['sizes'], sort_keys=True): run for run in old['runs']}
+
+    print('%-24s %10s %10s %8s' % ('stage', 'before', 'after', 'ratio'))
+    for run in new['runs']:
+        before = runs.get(json.dumps(run['sizes'], sort_keys=True))
+        if before is None:
+            continue
+
+        print('\n%s' % ', '.join('%s=%d' % item for item in sorted(run['sizes'].items())))
+        for stage in STAGES:
+            if stage in before['stages'] and stage in run['stages']:
+                a, b = before['stages'][stage], run['stages'][stage]
+                print('%-24s %9.4fs %9.4fs %7.2fx' % (stage, a, b, b / a if a else float('nan')))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time each stage of the chart pipeline on generated workbooks.')
+    parser.add_argument('--scale', type=float, nargs='+', default=[1],
+                        help='multiply every category and row count by each of these factors in turn (default: 1)')
+    for kind, n in SIZES.items():
+        parser.add_argument('--%s' % kind, type=int, default=n, help='number of %s (default: %d)' % (kind, n))
+    parser.add_argument('--rows', type=int, default=ROWS,
+                        help='number of records listed by province (default: %d)' % ROWS)
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='keep the fastest of this many runs (default: 3)')
+    parser.add_argument('-j', '--workers', type=app.positive_int, default=None,
+                        help='number of processes to render with (default: one per core)')
+    parser.add_argument('-e', '--export', choices=list(app.EXPORTS), default='png',
+                        help='way of writing the charts to time (default: png)')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the generated data (default: 0)')
+    parser.add_argument('--keep', help='generate the workbooks and charts in this folder and keep them')
+    parser.add_argument('-o', '--out', help='write the results to this JSON file instead of printing them')
+    parser.add_argument('--compare', help='print how the results compare with an earlier JSON file')
+    args = parser.parse_args(argv)
+
+    # Run the benchmark at every scale
+    runs = []
+    for scale in args.scale:
+        sizes = {kind: max(1, int(round(getattr(args, kind) * scale))) for kind in SIZES}
+        rows = max(1, int(round(args.rows * scale)))
+        runs.append(benchmark(sizes, rows, args.repeat, args.workers, args.seed, args.keep, args.export))
+
+    results = {'environment': environment(), 'runs': runs}
+
+    # Write or print the results
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=1)
+    else:
+        json.dump(results, sys.stdout, indent=1)
+        print()
+
+    # Compare them with an earlier run
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+# Number of records read at a time
+CHUNK_SIZE = 100000
+
+# Sheet of prov_by_food_adult.xlsx that lists whether each column counts a food or an adulterant
+COLUMNS_SHEET = 'columns'
+
+
+def read_chunks(fname, columns, chunksize=CHUNK_SIZE):
+    # If the records are in a CSV file
+    if fname.endswith('.csv'):
+        # Let pandas read the columns in chunks
+        yield from pd.read_csv(fname, usecols=columns, chunksize=chunksize)
+        return
+
+    from openpyxl import load_workbook
+
+    # Open the workbook without loading the whole sheet
+    wb = load_workbook(fname, read_only=True)
+
+    try:
+        # Loop through the rows of the first sheet
+        rows = wb.worksheets[0].iter_rows(values_only=True)
+
+        # Find the columns in the header
+        header = list(next(rows))
+        idx = [header.index(col) for col in columns]
+
+        chunk = []
+        for row in rows:
+            # Keep only the requested columns
+            chunk.append([row[i] for i in idx])
+
+            # Hand out the chunk once it is full
+            if len(chunk) == chunksize:
+                yield pd.DataFrame(chunk, columns=columns)
+                chunk = []
+
+        # Hand out the last chunk
+        if chunk:
+            yield pd.DataFrame(chunk, columns=columns)
+    finally:
+        wb.close()
+
+
+def encode(values, vocab):
+    # Add the labels that have not been seen yet
+    for label in pd.unique(values):
+        if label not in vocab:
+            vocab[label] = len(vocab)
+
+    # Convert the labels to their positions
+    return pd.Series(values).map(vocab).to_numpy(dtype=np.intp)
+
+
+def ingest(fname, province='data_source_province', food='prod_category_english_nn', adulterant='adulterant_category',
+           count=None, chunksize=CHUNK_SIZE):
+    # Positions of the provinces, foods and adulterants seen so far
+    vocabs = [{}, {}, {}]
+
+    # Counts by province, food and adulterant
+    counts = np.zeros((0, 0, 0), dtype=np.int64)
+
+    # Retrieve the columns to read
+    columns = [province, food, adulterant] + ([count] if count else [])
+
+    # Loop through the chunks of records
+    for chunk in read_chunks(fname, columns, chunksize):
+        # Skip records missing a category
+        chunk = chunk.dropna(subset=columns[:3])
+
+        # Convert the categories to positions
+        idx = tuple(encode(chunk[col].astype(str).str.strip().to_numpy(), vocab)
+                    for col, vocab in zip(columns, vocabs))
+
+        # Grow the counts to fit any new categories
+        shape = tuple(len(vocab) for vocab in vocabs)
+        if shape != counts.shape:
+            counts = np.pad(counts, [(0, new - old) for new, old in zip(shape, counts.shape)])
+
+        # Count each record, or add its count if there is a count column
+        weights = chunk[count].fillna(0).to_numpy(dtype=np.int64) if count else 1
+        np.add.at(counts, idx, weights)
+
+    # Retrieve the labels in the order of their positions
+    labels = [list(vocab) for vocab in vocabs]
+
+    return counts, labels
+
+
+def save_counts(counts, labels, fname):
+    # Name the labels of each axis
+    names = dict(zip(['provinces', 'foods', 'adults'], [np.array(_, dtype=str) for _ in labels]))
+
+    # If most of the counts are zero, store only the nonzero ones
+    if np.count_nonzero(counts) < counts.size / 2:
+        coords = np.nonzero(counts)
+        np.savez_compressed(fname, shape=counts.shape, coords=np.array(coords), values=counts[coords], **names)
+    else:
+        np.savez_compressed(fname, counts=counts, **names)
+
+
+def write_tables(counts, labels, folder='data'):
+    # Sort each set of labels
+    orders = [np.argsort(names, kind='stable') for names in labels]
+    counts = counts[np.ix_(*orders)]
+    provinces, foods, adults = [[names[i] for i in order] for names, order in zip(labels, orders)]
+
+    # Create the folder for the tables
+    os.makedirs(folder, exist_ok=True)
+
+    # Write the counts of each adulterant in each food
+    df = pd.DataFrame(counts.sum(axis=0), columns=adults)
+    df.insert(0, 'prod_category_english_nn', foods)
+    df.to_excel(os.path.join(folder, 'food_by_adult.xlsx'), index=False)
+
+    # Write the counts of each food and each adulterant in each province
+    df = pd.DataFrame(np.hstack([counts.sum(axis=2), counts.sum(axis=1)]), columns=foods + adults)
+    df.insert(0, 'level_1', provinces)
+
+    # List which columns count foods and which count adulterants, so the chart functions do not have to guess
+    kinds = pd.DataFrame({'column': foods + adults, 'kind': ['food'] * len(foods) + ['adulterant'] * len(adults)})
+
+    with pd.ExcelWriter(os.path.join(folder, 'prov_by_food_adult.xlsx')) as writer:
+        df.to_excel(writer, index=False)
+        kinds.to_excel(writer, sheet_name=COLUMNS_SHEET, index=False)
+
+    # Save the counts by province, food and adulterant, which the chart functions read first
+    save_counts(counts, [provinces, foods, adults], os.path.join(folder, 'counts.npz'))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Count raw inspection records into the tables the charts read.')
+    parser.add_argument('fname', help='CSV or Excel file of raw records, one per row')
+    parser.add_argument('--province', default='data_source_province', help='column holding the province')
+    parser.add_argument('--food', default='prod_category_english_nn', help='column holding the food type')
+    parser.add_argument('--adulterant', default='adulterant_category', help='column holding the adulterant type')
+    parser.add_argument('--count', help='column holding the number of records each row stands for')
+    parser.add_argument('--chunksize', type=int, default=CHUNK_SIZE, help='number of records read at a time')
+    parser.add_argument('--out', default='data', help='folder to write the tables to (default: data)')
+    args = parser.parse_args(argv)
+
+    # Count the records
+    counts, labels = ingest(args.fname, args.province, args.food, args.adulterant, args.count, args.chunksize)
+
+    # Write the tables
+    write_tables(counts, labels, args.out)
+
+    print('Counted %d records across %d provinces, %d foods and %d adulterants.'
+          % ((counts.sum(),) + counts.shape))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,19 +1,526 @@
-import matplotlib.pyplot as plt
-import numpy as np
-import pandas as pd
-from pluralizer import Pluralizer
+import time
+
+# Time the program started loading, for reporting how long it takes to be ready
+STARTED = time.perf_counter()
+
+import argparse
+import cProfile
+import glob
+import hashlib
+import importlib
+import io
+import json
+import os
+import threading
+import tracemalloc
+import zipfile
+from collections import Counter
+from fnmatch import fnmatch
+from functools import lru_cache, wraps
+from importlib.util import find_spec
+
+
+class LazyModule:
+    def __init__(self, name, alias):
+        # Remember the module to import and the global name it is used under
+        self._name = name
+        self._alias = alias
+
+    def __getattr__(self, attr):
+        # Import the module the first time it is used
+        module = importlib.import_module(self._name)
+        # Use the module itself from now on
+        globals()[self._alias] = module
+        return getattr(module, attr)
+
+
+# Import the plotting and data libraries only once they are used, so the comparison menu appears right away
+matplotlib = LazyModule('matplotlib', 'matplotlib')
+plt = LazyModule('matplotlib.pyplot', 'plt')
+np = LazyModule('numpy', 'np')
+pd = LazyModule('pandas', 'pd')
+
+# Optional libraries, or None if they are not installed
+feather = LazyModule('pyarrow.feather', 'feather') if find_spec('pyarrow') else None
+sparse = LazyModule('scipy.sparse', 'sparse') if find_spec('scipy') else None
+
+# Name of the folder next to each workbook that holds its columnar copies
+SIDECAR_DIR = '.cache'
+
+# Largest share of distinct values a text column can have to be stored as categories
+CATEGORY_RATIO = 0.5
+
+# Sheet of prov_by_food_adult.xlsx that lists whether each column counts a food or an adulterant
+COLUMNS_SHEET = 'columns'
+
+# Number of formatted titles and labels to remember
+LABEL_CACHE_SIZE = 4096
+
+# Record of the hash of every chart rendered so far
+MANIFEST = 'charts/manifest.json'
+
+# Settings shared by every pie chart
+PIE_STYLE = {'autopct': '%.1f%%', 'pctdistance': 0.85}
+
+# Color of 'Other' in every chart
+OTHER_COLOR = (0.75, 0.75, 0.75, 1.0)
+
+# Errors raised when a workbook or the counts are missing, truncated or laid out differently than expected
+LOAD_ERRORS = (OSError, LookupError, ValueError, zipfile.BadZipFile)
+
+# Counts by province, food and adulterant written by the ingest stage
+COUNTS = 'data/counts.npz'
+
+# Largest share of nonzero counts for which the province x adulterant counts are stored sparsely
+SPARSE_DENSITY = 0.25
+
+# File extension written by each way of exporting the charts
+EXPORTS = {'png': 'png', 'fast': 'png', 'buffer': 'png', 'svg': 'svg', 'pdf': 'pdf', 'tiles': 'png'}
+
+# Largest number of charts drawn as tiles on one page
+TILES_PER_PAGE = 16
+
+# Width and height of each tile, in inches
+TILE_SIZE = 4
+
+# zlib compression level of the fast PNG exports, trading larger files for quicker encoding
+FAST_PNG_LEVEL = 1
+
+# Metadata left out of each vector format, so the same chart is always written as the same bytes
+METADATA = {'svg': {'Date': None}, 'pdf': {'CreationDate': None}}
+
+# Salt of the ids in SVG files, fixed so they do not change from one render to the next
+SVG_HASH_SALT = 'charts'
+
+# Options listed by the comparison menu, saved so the menu can be shown before the workbooks are read
+LABELS = os.path.join('data', SIDECAR_DIR, 'labels.json')
+
+# Functions whose calls are timed while profiling
+PROFILED = ['get_data', 'get_food_model', 'get_prov_model', 'create_other_category', 'create_other_matrix', 'format',
+            'pie_cht', 'pie_data', 'bar_cht']
+
+# Render jobs collected during a batch, or None to draw charts immediately
+render_queue = None
+
+# Renderer that owns this process's figure, created when first needed
+renderer = None
+
+# Parsed workbooks and the frames derived from them, keyed by file name
+cache = {}
+
+# Options listed by the comparison menu and their formatted names, read from LABELS when first needed
+labels = None
+
+# Locks that let a background thread fill the cache while the main thread reads it, one per file name
+file_locks = {}
+
+# Lock held only while looking up or creating the lock of a file
+cache_lock = threading.Lock()
+
+# Lock that keeps threads from collecting charts at the same time, since they share the render queue
+collect_lock = threading.Lock()
+
+# Lock that keeps threads from loading or saving the comparison menu options at the same time
+labels_lock = threading.Lock()
+
+# Profiler recording the calls of the profiled functions, or None when profiling is off
+profiler = None
+
+# Color of every food, adulterant and province, rebuilt when the data changes
+palette = None
+
+# Palette of the charts being collected, looked up at most once per batch, or None outside a batch
+batch_palette = None
+
+
+def file_stamp(fname):
+    # Retrieve the file's metadata
+    stat = os.stat(fname)
+    # Identify the file's contents by its modification time and size
+    return stat.st_mtime_ns, stat.st_size
+
+
+def sidecar_name(fname, digest, ext):
+    # Split the workbook path into its folder and name
+    folder, name = os.path.split(fname)
+    # Name the copy after the workbook and the hash of its contents
+    return os.path.join(folder, SIDECAR_DIR, '%s.%s.%s' % (os.path.splitext(name)[0], digest, ext))
+
+
+def read_sidecar(path):
+    # If the copy is in Feather format
+    if path.endswith('.feather'):
+        # Memory-map the file instead of reading it into a buffer
+        return feather.read_table(path, memory_map=True).to_pandas()
+    # Otherwise, read the pickled copy
+    return pd.read_pickle(path)
+
+
+def write_sidecar(df, fname, digest):
+    # Create the folder for the copies
+    os.makedirs(os.path.dirname(sidecar_name(fname, digest, 'tmp')), exist_ok=True)
+
+    # Remove copies of older versions of the workbook
+    for path in glob.glob(sidecar_name(fname, '*', '*')):
+        os.remove(path)
+
+    # Write to a temporary file so a partial copy is never read
+    tmp = sidecar_name(fname, digest, 'tmp')
+
+    try:
+        # Feather requires pyarrow and string column names
+        if feather is None:
+            raise ImportError('pyarrow is not installed')
+        df.to_feather(tmp)
+        ext = 'feather'
+    except (ImportError, TypeError, ValueError):
+        # Fall back to a pickled copy
+        df.to_pickle(tmp)
+        ext = 'pkl'
+
+    # Move the finished copy into place
+    os.replace(tmp, sidecar_name(fname, digest, ext))
+
+
+def narrow_dtypes(df):
+    # Loop through the columns
+    for name in df.columns:
+        col = df[name]
+
+        # Leave columns that are already categories
+        if isinstance(col.dtype, pd.CategoricalDtype):
+            continue
+
+        # If the column holds labels that repeat, store each distinct label once
+        if pd.api.types.is_string_dtype(col) or col.dtype == object:
+            if col.nunique() <= CATEGORY_RATIO * len(col):
+                df[name] = col.astype('category')
+        # Store counts in the smallest integer type that holds them
+        elif pd.api.types.is_integer_dtype(col) and not pd.api.types.is_bool_dtype(col):
+            df[name] = pd.to_numeric(col, downcast='integer')
+        # Store percentages and rates in single precision
+        elif pd.api.types.is_float_dtype(col):
+            df[name] = col.astype('float32')
+
+    return df
+
+
+def widen_dtypes(df):
+    wide = {}
+
+    # Find the type each column would have had as parsed
+    for name in df.columns:
+        col = df[name]
+        if isinstance(col.dtype, pd.CategoricalDtype):
+            wide[name] = col.cat.categories.dtype
+        elif pd.api.types.is_integer_dtype(col) and not pd.api.types.is_bool_dtype(col):
+            wide[name] = 'int64'
+        elif pd.api.types.is_float_dtype(col):
+            wide[name] = 'float64'
+
+    return df.astype(wide)
+
+
+def array_bytes(values, itemsize=None):
+    # Measure the stored values, and the positions of a sparse matrix's values
+    if sparse is not None and sparse.issparse(values):
+        return array_bytes(values.data, itemsize) + values.indices.nbytes + values.indptr.nbytes
+
+    return values.size * itemsize if itemsize else values.nbytes
+
+
+def memory_rows():
+    rows = []
+
+    # Loop through the files read so far
+    for fname, entry in sorted(cache.items()):
+        name = os.path.basename(fname)
+
+        # Loop through the tables read or derived from the file
+        for key, value in entry['frames'].items():
+            # Measure the table as parsed and as it is kept
+            if isinstance(value, pd.DataFrame):
+                table = name if key is None else '%s %s' % (name, ' '.join(key) if isinstance(key, tuple) else key)
+                before = widen_dtypes(value).memory_usage(deep=True).sum()
+                after = value.memory_usage(deep=True).sum()
+            # Measure the counts of the model as double precision and as they are kept
+            elif key == 'model':
+                arrays = [_ for _ in value.values() if isinstance(_, np.ndarray) or
+                          (sparse is not None and sparse.issparse(_))]
+                table = '%s model' % name
+                before = sum(array_bytes(_, 8) for _ in arrays)
+                after = sum(array_bytes(_) for _ in arrays)
+            else:
+                continue
+
+            rows.append({'table': table, 'before': int(before), 'after': int(after)})
+
+    return rows
+
+
+def memory_summary():
+    rows = memory_rows()
+    lines = ['%-44s %12s %12s %8s' % ('table', 'wide KB', 'kept KB', 'saved')]
+
+    # Add a line for each table and one for all of them
+    for row in rows + [{'table': 'total', 'before': sum(_['before'] for _ in rows),
+                        'after': sum(_['after'] for _ in rows)}]:
+        lines.append('%-44s %12.1f %12.1f %7.1f%%' % (
+            row['table'], row['before'] / 2 ** 10, row['after'] / 2 ** 10,
+            100 * (1 - row['after'] / row['before']) if row['before'] else 0))
+
+    return '\n'.join(lines)
+
+
+def load_workbook(fname):
+    # Hash the contents of the workbook
+    with open(fname, 'rb') as f:
+        digest = hashlib.sha1(f.read()).hexdigest()[:16]
+
+    # Loop through the possible copies of this version of the workbook
+    for ext in ['feather', 'pkl']:
+        path = sidecar_name(fname, digest, ext)
+
+        # If the copy exists
+        if os.path.exists(path):
+            try:
+                # Read the copy, narrowing copies saved before the types were
+                return narrow_dtypes(read_sidecar(path))
+            except Exception:
+                # Fall back to the workbook if the copy cannot be read
+                break
+
+    # Parse the workbook and store each column in the smallest type that holds it
+    df = narrow_dtypes(pd.read_excel(fname))
+
+    try:
+        # Save a copy for later runs
+        write_sidecar(df, fname, digest)
+    except OSError:
+        # Carry on without a copy if the folder is not writable
+        pass
+
+    return df
+
+
+def load_file(fname):
+    # Read the counts written by the ingest stage or parse the workbook
+    return load_counts(fname) if fname.endswith('.npz') else load_workbook(fname)
+
+
+def file_lock(fname):
+    # Retrieve the lock of the file, creating it the first time
+    with cache_lock:
+        return file_locks.setdefault(fname, threading.RLock())
+
+
+def read_data(fname, key=None, derive=None):
+    # Wait only for other threads reading or deriving data from the same file
+    with file_lock(fname):
+        # Retrieve the cached entry for the file
+        entry = cache.get(fname)
+        # Retrieve the current state of the file
+        stamp = file_stamp(fname)
+
+        # If the file has not been read yet or has changed since
+        if entry is None or entry['stamp'] != stamp:
+            # Start a new entry
+            entry = {'stamp': stamp, 'frames': {}}
+            cache[fname] = entry
+
+        # Retrieve the frames read or derived from the file
+        frames = entry['frames']
+
+        # If the requested frame has not been computed yet
+        if key not in frames:
+            # Read the file itself or derive the frame from it
+            frames[key] = load_file(fname) if key is None else derive(read_data(fname))
+
+        # Return a copy so callers can modify it freely
+        return frames[key].copy()
 
 
 def get_data(func):
     # Get file name
     fname = 'data/%s.xlsx' % func.__name__
     # Read data
-    return pd.read_excel(fname)
+    return read_data(fname)
+
+
+def get_prov_data():
+    # Read data grouped by province and summed, narrowing the sums as the workbook was
+    return read_data('data/prov_by_food_adult.xlsx', 'level_1', lambda df: narrow_dtypes(
+        df.groupby('level_1', as_index=False, observed=True).sum(numeric_only=True)))
+
+
+def read_column_kinds(fname):
+    from openpyxl import load_workbook as open_workbook
+
+    # Open the workbook without loading its sheets
+    wb = open_workbook(fname, read_only=True)
+
+    try:
+        # If the workbook was not written by the ingest stage, it does not list its columns
+        if COLUMNS_SHEET not in wb.sheetnames:
+            return None
+
+        # Skip the header and map each column to whether it counts a food or an adulterant
+        rows = wb[COLUMNS_SHEET].iter_rows(values_only=True)
+        next(rows, None)
+        return {str(name): kind for name, kind in rows}
+    finally:
+        wb.close()
+
+
+def prov_schema(df, kinds=None):
+    # Retrieve the column names
+    names = list(df.columns)
+
+    # If the workbook lists what each column counts, split the columns by it
+    if kinds is not None:
+        foods = [name for name in names[1:] if kinds.get(name) == 'food']
+        adults = [name for name in names[1:] if kinds.get(name) == 'adulterant']
+    else:
+        # Otherwise, the adulterant columns start at the first header containing 'contaminant'
+        idx = next((i for i, name in enumerate(names) if 'contaminant' in name.lower()), len(names))
+        foods, adults = names[1:idx], names[idx:]
+
+    # Record the province column, the provinces, the food columns and the adulterant columns
+    return {'label': names[0], 'provinces': list(df[names[0]]), 'foods': foods, 'adults': adults}
+
+
+def get_prov_schema():
+    fname = 'data/prov_by_food_adult.xlsx'
+
+    # Index the layout of the grouped data once per version of the workbook
+    return read_data(fname, 'schema', lambda _: prov_schema(get_prov_data(), read_column_kinds(fname)))
+
+
+def load_counts(fname):
+    # Read the counts written by the ingest stage
+    with np.load(fname) as data:
+        # Retrieve the labels of each axis
+        labels = [[str(_) for _ in data[name]] for name in ['provinces', 'foods', 'adults']]
+
+        # If only the nonzero counts were stored, keep them that way
+        if 'coords' in data:
+            return {'shape': tuple(data['shape']), 'coords': data['coords'], 'values': data['values'].astype(float),
+                    'labels': labels}
+
+        return {'counts': data['counts'].astype(float), 'labels': labels}
+
+
+def sum_counts(data, axis):
+    # If the counts are dense, sum them over the axis
+    if 'coords' not in data:
+        return data['counts'].sum(axis=axis)
+
+    # Retrieve the axes that remain
+    keep = [i for i in range(3) if i != axis]
+    shape = tuple(data['shape'][i] for i in keep)
+
+    # Add up the nonzero counts that fall in each cell of the remaining axes
+    idx = np.ravel_multi_index(tuple(data['coords'][keep]), shape)
+    return np.bincount(idx, weights=data['values'], minlength=int(np.prod(shape))).reshape(shape)
+
+
+def to_sparse(matrix):
+    # Keep the matrix dense if scipy is missing or most of the counts are nonzero
+    if sparse is None or np.count_nonzero(matrix) > SPARSE_DENSITY * matrix.size:
+        return matrix
+
+    # Store only the nonzero counts, column by column
+    return sparse.csc_matrix(matrix)
+
+
+def to_dense(matrix):
+    # Expand a sparse matrix into a regular array
+    return matrix.toarray() if sparse is not None and sparse.issparse(matrix) else matrix
+
+
+def narrow_counts(values):
+    # Keep counts that are not whole numbers in single precision
+    if not np.array_equal(values, np.round(values)):
+        return values.astype(np.float32)
+
+    # Store whole counts in the smallest integer type that holds them
+    lo, hi = (values.min(), values.max()) if values.size else (0, 0)
+    dtype = next(_ for _ in [np.int8, np.int16, np.int32, np.int64] if np.iinfo(_).min <= lo and hi <= np.iinfo(_).max)
+    return values.astype(dtype)
+
+
+def food_model(food_adult, foods, adults):
+    # Record the counts of each adulterant in each food and their totals
+    return {'fa_foods': foods, 'fa_adults': adults, 'food_adult': food_adult,
+            'adult_in_all_food': food_adult.sum(axis=0), 'food_by_all_adult': food_adult.sum(axis=1)}
+
+
+def prov_model(prov_food, prov_adult, provinces, foods, adults):
+    # Store the adulterant counts sparsely if most of them are zero
+    prov_adult = to_sparse(prov_adult)
+
+    # Record the counts of each food and adulterant in each province and their totals
+    return {'provinces': provinces, 'foods': foods, 'adults': adults, 'prov_food': prov_food,
+            'prov_adult': prov_adult, 'food_by_all_prov': prov_food.sum(axis=0),
+            'prov_by_all_food': prov_food.sum(axis=1), 'adult_in_all_prov': np.asarray(prov_adult.sum(axis=0)).ravel(),
+            'prov_by_all_adult': np.asarray(prov_adult.sum(axis=1)).ravel()}
+
+
+def tensor_model(data):
+    # Retrieve the labels of the counts by province, food and adulterant
+    provinces, foods, adults = data['labels']
+
+    # Every table is a sum of the counts over one axis
+    return dict(food_model(narrow_counts(sum_counts(data, 0)), foods, adults),
+                **prov_model(narrow_counts(sum_counts(data, 2)), narrow_counts(sum_counts(data, 1)), provinces, foods,
+                             adults))
+
+
+def read_food_model(df):
+    # Retrieve the counts, treating missing values as zero, in the smallest type that holds them
+    food_adult = narrow_counts(np.nan_to_num(df.iloc[:, 1:].to_numpy(dtype=float)))
+
+    return food_model(food_adult, list(df[df.columns[0]]), list(df.columns[1:]))
+
+
+def read_prov_model():
+    # Read data grouped by province
+    df = get_prov_data()
+    schema = get_prov_schema()
+
+    # Retrieve the food and adulterant counts, treating missing values as zero, in the smallest type that holds them
+    prov_food = narrow_counts(np.nan_to_num(df[schema['foods']].to_numpy(dtype=float)))
+    prov_adult = narrow_counts(np.nan_to_num(df[schema['adults']].to_numpy(dtype=float)))
+
+    return prov_model(prov_food, prov_adult, schema['provinces'], schema['foods'], schema['adults'])
+
+
+def get_food_model():
+    # If the ingest stage has counted the raw records, use the full counts
+    if os.path.exists(COUNTS):
+        return read_data(COUNTS, 'model', tensor_model)
+
+    # Otherwise, read the counts of each adulterant in each food
+    return read_data('data/food_by_adult.xlsx', 'model', read_food_model)
+
+
+def get_prov_model():
+    # If the ingest stage has counted the raw records, use the full counts
+    if os.path.exists(COUNTS):
+        return read_data(COUNTS, 'model', tensor_model)
+
+    # Otherwise, read the counts of each food and adulterant in each province
+    return read_data('data/prov_by_food_adult.xlsx', 'model', lambda _: read_prov_model())
+
+
+def get_model():
+    # Combine the food and province counts
+    return dict(get_food_model(), **get_prov_model())
 
 
 def rename_categories(df):
     # Create a new category that renames the two categories
-    df['x'] = df.iloc[:, 0] + ' (' + df.iloc[:, 1].astype(str) + ')'
+    df['x'] = df.iloc[:, 0].astype(str) + ' (' + df.iloc[:, 1].astype(str) + ')'
     return df
 
 
@@ -22,10 +529,13 @@ def create_other_category(df, x='x', y='perc', threshold=5):
     threshold *= df[y].sum() / 100
     # Combine values that are a small portion of the total
     mask = df[y] < threshold
+    # Let a column of categories hold 'Other'
+    if isinstance(df[x].dtype, pd.CategoricalDtype) and 'Other' not in df[x].cat.categories:
+        df[x] = df[x].cat.add_categories('Other')
     # Set the food type to 'Other' if the food type has less than the threshold
     df.loc[mask, x] = 'Other'
     # Group by the food type and sum the percentage
-    df = df.groupby(x).sum(numeric_only=False).reset_index()
+    df = df.groupby(x, observed=True).sum(numeric_only=True).reset_index()
 
     # Separate 'Other' from the rest
     df_other = df[df[x] == 'Other']
@@ -44,32 +554,614 @@ def create_other_category(df, x='x', y='perc', threshold=5):
     return df
 
 
-def pie_cht(df, title, fname, x='x', y='perc', subfolder=None):
-    # Create a color map
-    cmap = plt.get_cmap()
-    # Create a list of colors
-    colors = cmap(np.linspace(1, 0.25, len(df[x])))
+def create_other_matrix(values, labels, threshold=5, axis=0):
+    # If the counts are sparse, only look at the nonzero ones
+    if sparse is not None and sparse.issparse(values):
+        return create_other_sparse(values.T if axis == 1 else values, labels, threshold)
 
-    # Set the size of the plot
-    # plt.figure(figsize=(10, 6))
-    # Capitalize the labels
-    labels = [' '.join(label.split('_')).title() for label in df[x]]
-    # Create a pie chart
-    plt.pie(df[y], labels=labels, colors=colors, autopct='%.1f%%', pctdistance=0.85)
-    # Set the title of the plot
-    plt.title(title)
+    # Treat missing values as zero and make each chart a column
+    values = np.nan_to_num(np.asarray(values, dtype=float))
+    if axis == 1:
+        values = values.T
+
+    # Sort the labels alphabetically, as grouping by them does
+    labels = np.asarray(labels, dtype=object)
+    order = np.argsort(labels, kind='stable')
+    labels = labels[order]
+    values = values[order]
+
+    # Convert threshold to a percentage of the total of each column
+    cutoff = threshold * values.sum(axis=0) / 100
+    # Combine values that are a small portion of the total
+    mask = values < cutoff
+    # Sum the values that make up 'Other' in each column
+    other = np.where(mask, values, 0).sum(axis=0)
+
+    # Sort each column in descending order, moving the values in 'Other' to the end
+    ranks = np.argsort(-np.where(mask, -np.inf, values), axis=0, kind='stable')
+    # Count the values that are kept in each column
+    kept = (~mask).sum(axis=0)
+
+    slices = []
+
+    # Loop through the columns
+    for i in range(values.shape[1]):
+        # Retrieve the kept values in descending order
+        idx = ranks[:kept[i], i]
+        chart_labels = labels[idx]
+        chart_values = values[idx, i]
+
+        # Add 'Other' at the end regardless of its value
+        if kept[i] < len(labels):
+            chart_labels = np.append(chart_labels, 'Other')
+            chart_values = np.append(chart_values, other[i])
+
+        # Remove the last value if it is 0
+        if len(chart_values) and chart_values[-1] == 0:
+            chart_labels = chart_labels[:-1]
+            chart_values = chart_values[:-1]
+
+        slices.append((chart_labels, chart_values))
+
+    return slices
+
+
+def chart_path(fname, subfolder=None):
     # Retrieve the name of the folder to save the plot
     folder = fname.split('_')[0]
     # If there are no special instructions on where to save the plot
-    # if not subfolder:
-    # Save the plot
-    # plt.savefig('charts/%s/%s.png' % (folder, fname))
-    # else:
+    if not subfolder:
+        return 'charts/%s/%s.png' % (folder, fname)
+    # Otherwise, save the plot in the subfolder named after the function
+    return 'charts/%s/%s/%s.png' % (folder, subfolder.__name__, fname)
+
+
+def create_other_sparse(values, labels, threshold=5):
+    # Store each column's nonzero values together
+    values = sparse.csc_matrix(values)
+    values.eliminate_zeros()
+    labels = np.asarray(labels, dtype=object)
+
+    slices = []
+
+    # Loop through the columns
+    for i in range(values.shape[1]):
+        # Retrieve the rows and nonzero values of the column
+        rows = values.indices[values.indptr[i]:values.indptr[i + 1]]
+        col = values.data[values.indptr[i]:values.indptr[i + 1]]
+
+        # Combine values that are a small portion of the total
+        mask = col < threshold * col.sum() / 100
+
+        # Sort the kept values in descending order, breaking ties alphabetically
+        kept = rows[~mask]
+        kept_values = col[~mask]
+        order = sorted(range(len(kept)), key=lambda j: (-kept_values[j], labels[kept[j]]))
+        chart_labels = labels[kept[order]]
+        chart_values = kept_values[order]
+
+        # Add 'Other' at the end if anything was combined
+        other = col[mask].sum()
+        if other:
+            chart_labels = np.append(chart_labels, 'Other')
+            chart_values = np.append(chart_values, other)
+
+        slices.append((chart_labels, chart_values))
+
+    return slices
+
+
+@lru_cache(maxsize=None)
+def pie_colors(n):
+    # Create a color map
+    cmap = plt.get_cmap()
+    # Create a list of colors
+    return cmap(np.linspace(1, 0.25, n))
+
+
+def build_palette(groups):
+    # Retrieve the color map
+    cmap = plt.get_cmap()
+
+    colors = {}
+    for group in groups:
+        # Sample the color map across each group, since the slices of a chart come from the same group
+        group = sorted(set(group) - set(colors))
+        colors.update(zip(group, cmap(np.linspace(1, 0.25, len(group)))))
+
+    # Give 'Other' the same neutral color everywhere
+    colors['Other'] = OTHER_COLOR
+
+    # Index the labels so a whole chart's colors can be looked up at once
+    return {'index': pd.Index(list(colors)), 'colors': np.array(list(colors.values()))}
+
+
+def get_palette():
+    global palette
+
+    # Build the palette once per version of the data
+    version = data_version()
+    if palette is None or palette['version'] != version:
+        groups = [[], [], []]
+
+        # Collect every food, adulterant and province in the counts that can be read
+        for part in [get_food_model, get_prov_model]:
+            try:
+                model = part()
+            except LOAD_ERRORS:
+                continue
+            groups[0] += model.get('fa_foods', []) + model.get('foods', [])
+            groups[1] += model.get('fa_adults', []) + model.get('adults', [])
+            groups[2] += list(model.get('provinces', []))
+
+        # Include the options of the comparison menu when their workbooks exist
+        for group, func in zip(groups, [food_by_fail, adult_by_fail, prov_by_recs]):
+            if os.path.exists('data/%s.xlsx' % func.__name__):
+                group += get_labels(func)
+
+        palette = dict(build_palette(groups), version=version)
+
+    return palette
+
+
+def load_palette():
+    try:
+        return get_palette()
+    except LOAD_ERRORS:
+        # Color by position if the counts cannot be read
+        return None
+
+
+def label_colors(labels, entry):
+    # Color by position if there is no palette
+    if entry is None:
+        return pie_colors(len(labels))
+
+    # Find the position of every label in the palette
+    idx = entry['index'].get_indexer(labels)
+
+    # If any label is not a food, adulterant or province, color by position as before
+    if (idx < 0).any():
+        return pie_colors(len(labels))
+
+    return entry['colors'][idx]
+
+
+class Renderer:
+    def __init__(self):
+        # Name the clip paths of SVG files the same way in every process
+        matplotlib.rcParams['svg.hashsalt'] = SVG_HASH_SALT
+
+        # Create the one figure and axes that every chart is drawn on
+        self.fig = plt.figure()
+        self.ax = self.fig.gca()
+
+    def clear(self):
+        # Remove the previous chart while keeping the figure
+        self.ax.clear()
+        # Undo the equal aspect ratio and hidden frame left behind by pie charts
+        self.ax.set_aspect('auto')
+        self.ax.set_frame_on(True)
+        return self.ax
+
+    def pie(self, job):
+        ax = self.clear()
+        # Create a pie chart
+        ax.pie(job['values'], labels=job['labels'], colors=job['colors'], **PIE_STYLE)
+        # Set the title of the plot
+        ax.set_title(job['title'])
+
+    def tiles(self, jobs, path):
+        from matplotlib.patches import Patch
+
+        # Lay the charts out in a grid as close to square as possible
+        cols = int(np.ceil(np.sqrt(len(jobs))))
+        rows = int(np.ceil(len(jobs) / cols))
+
+        # Retrieve the color of each label, which is the same in every tile
+        colors = {}
+        for job in jobs:
+            for label, color in zip(job['labels'], job['colors']):
+                colors.setdefault(label, color)
+        names = list(colors)
+
+        # Lay the legend out in rows below the grid
+        ncol = min(len(names), cols * 2)
+        legend = (np.ceil(len(names) / ncol) * 0.3 + 0.2) / (TILE_SIZE * rows)
+
+        # Create a page for the grid with fixed spacing, which is much quicker than fitting the layout to the text
+        fig, axes = plt.subplots(rows, cols, figsize=(TILE_SIZE * cols, TILE_SIZE * rows), squeeze=False,
+                                 gridspec_kw={'left': 0.02, 'right': 0.98, 'top': 1 - 0.3 / (TILE_SIZE * rows),
+                                              'bottom': legend, 'wspace': 0.1, 'hspace': 0.2})
+
+        # Draw each chart in its own tile, without labels since the legend names every slice
+        for ax, job in zip(axes.flat, jobs):
+            ax.pie(job['values'], colors=[colors[label] for label in job['labels']], **PIE_STYLE)
+            ax.set_title(job['title'], fontsize='small')
+
+        # Hide the tiles left over
+        for ax in axes.flat[len(jobs):]:
+            ax.set_axis_off()
+
+        # Name every slice once for the whole page
+        fig.legend(handles=[Patch(facecolor=colors[name], label=name) for name in names], loc='lower center',
+                   ncol=ncol, frameon=False)
+
+        # Save the page in one pass and close it, keeping only the reused figure open
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fig.savefig(path)
+        plt.close(fig)
+
+    def bar(self, df, title, colors=None):
+        ax = self.clear()
+
+        # Create a grouped bar chart, splitting each group between the columns
+        bar_width = 0.8 / len(df.columns)
+
+        index = np.arange(len(df.index))
+
+        # Create the bars
+        for i, col in enumerate(df.columns):
+            ax.bar(index + i * bar_width, df[col], bar_width, label=col, color=None if colors is None else colors[i])
+
+        # Set the title and labels
+        ax.set_title(title)
+        ax.set_xlabel('Category')
+        ax.set_ylabel('Count')
+
+        # Set the x-axis labels
+        ax.set_xticks(index + bar_width * (len(df.columns) - 1) / 2, df.index)
+
+        # Adding legend
+        ax.legend()
+
+    def encode(self, export='png'):
+        buf = io.BytesIO()
+
+        # Compress PNGs less if requested, and leave the time out of vector formats
+        kwargs = {'pil_kwargs': {'compress_level': FAST_PNG_LEVEL}} if export in ['fast', 'buffer'] else {}
+        if EXPORTS[export] in METADATA:
+            kwargs['metadata'] = METADATA[EXPORTS[export]]
+
+        # Save the plot to memory
+        self.fig.savefig(buf, format=EXPORTS[export], **kwargs)
+        return buf.getvalue()
+
+    def save(self, path, export='png'):
+        # Create the folder to save the plot
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # If the PNG should be encoded straight from the drawn pixels
+        if export == 'buffer' and hasattr(self.fig.canvas, 'buffer_rgba'):
+            from PIL import Image
+
+            # Draw the figure once and encode its pixels, skipping the extra layout pass of savefig
+            self.fig.canvas.draw()
+            buf = self.fig.canvas.buffer_rgba()
+            Image.frombuffer('RGBA', (buf.shape[1], buf.shape[0]), buf, 'raw', 'RGBA', 0, 1).save(
+                path, compress_level=FAST_PNG_LEVEL)
+        # If the PNG should be compressed less
+        elif export in ['fast', 'buffer']:
+            self.fig.savefig(path, pil_kwargs={'compress_level': FAST_PNG_LEVEL})
+        # Otherwise, save the plot in the format named by its extension, leaving the time out of vector formats
+        else:
+            self.fig.savefig(path, metadata=METADATA.get(os.path.splitext(path)[1][1:]))
+
+
+def get_renderer():
+    global renderer
+
+    # Create the renderer for this process the first time it is needed
+    if renderer is None:
+        renderer = Renderer()
+
+    return renderer
+
+
+def render_job(job, export='png'):
+    # Start the timer
+    start = time.perf_counter()
+
+    # Draw the chart on this process's figure
+    get_renderer().pie(job)
     # Save the plot
-    # plt.savefig('charts/%s/%s/%s.png' % (folder, subfolder.__name__, fname))
-    # plt.show()
-    # Wait before creating the next chart
-    # plt.pause(2)
+    get_renderer().save(job['path'], export)
+
+    return job['path'], time.perf_counter() - start
+
+
+def render_file(unit):
+    # If the charts are drawn as tiles of one page, render the page in one pass
+    if unit['export'] == 'tiles' and len(unit['jobs']) > 1:
+        start = time.perf_counter()
+        get_renderer().tiles(unit['jobs'], unit['path'])
+        return unit['path'], time.perf_counter() - start
+
+    # If the charts are written to a single file, render them one at a time
+    if unit['export'] != 'pdf':
+        return render_job(dict(unit['jobs'][0], path=unit['path']), unit['export'])
+
+    from matplotlib.backends.backend_pdf import PdfPages
+
+    # Start the timer
+    start = time.perf_counter()
+
+    # Create the folder to save the document
+    os.makedirs(os.path.dirname(unit['path']), exist_ok=True)
+
+    # Draw each chart of the family on its own page of one document
+    with PdfPages(unit['path'], metadata=METADATA['pdf']) as pdf:
+        for job in unit['jobs']:
+            get_renderer().pie(job)
+            pdf.savefig(get_renderer().fig)
+
+    return unit['path'], time.perf_counter() - start
+
+
+@lru_cache(maxsize=LABEL_CACHE_SIZE)
+def title_label(label):
+    # Replace underscores and capitalize each word
+    return ' '.join(label.split('_')).title()
+
+
+def pie_cht(df, title, fname, x='x', y='perc', subfolder=None):
+    # Labels combined with their codes are never a food, adulterant or province, so color them by position
+    colors = pie_colors(len(df)) if x == 'x' else None
+
+    # Create a pie chart from the two columns
+    pie_data(df[x], df[y], title, fname, subfolder, colors)
+
+
+def pie_data(labels, values, title, fname, subfolder=None, colors=None):
+    # Skip charts with nothing to show
+    if not np.any(values):
+        return
+
+    # Retrieve the color of each slice's label, looking the palette up once per batch
+    if colors is None:
+        colors = label_colors(labels, batch_palette() if batch_palette is not None else load_palette())
+
+    # Capitalize the labels
+    labels = [title_label(label) for label in labels]
+
+    # Collect everything needed to draw the chart in a picklable job
+    job = {'values': np.asarray(values, dtype=float), 'labels': labels, 'colors': colors, 'title': title,
+           'path': chart_path(fname, subfolder)}
+
+    # If a batch is being collected, render the chart later
+    if render_queue is not None:
+        render_queue.append(job)
+        return
+
+    # Otherwise, draw the chart right away
+    get_renderer().pie(job)
+
+
+def init_worker():
+    global renderer
+
+    # Render without a display in worker processes
+    plt.switch_backend('Agg')
+    # Start from a figure created with that backend
+    renderer = None
+
+
+def job_hash(job):
+    # Hash everything that affects how the chart looks
+    h = hashlib.sha1()
+    h.update(np.ascontiguousarray(job['values']).tobytes())
+    h.update(np.ascontiguousarray(job['colors']).tobytes())
+    h.update(repr((job['labels'], job['title'], PIE_STYLE, matplotlib.__version__)).encode())
+    return h.hexdigest()
+
+
+def file_hash(jobs, export):
+    # Hash the way the file is exported along with every chart in it
+    h = hashlib.sha1(export.encode())
+    for job in jobs:
+        h.update(job_hash(job).encode())
+    return h.hexdigest()
+
+
+def export_path(job, export='png'):
+    # Write every chart of a family to one document, or one page of tiles, named after its chart function
+    if export in ['pdf', 'tiles']:
+        return os.path.splitext(chart_path(job['family']))[0] + '.' + EXPORTS[export]
+
+    # Otherwise, write each chart to its own file
+    return os.path.splitext(job['path'])[0] + '.' + EXPORTS[export]
+
+
+def read_manifest():
+    try:
+        # Read the hashes of the charts rendered so far
+        with open(MANIFEST) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        # Start over if there is no usable manifest
+        return {}
+
+
+def write_manifest(manifest):
+    # Create the folder for the manifest
+    os.makedirs(os.path.dirname(MANIFEST), exist_ok=True)
+
+    # Write to a temporary file so a partial manifest is never read
+    tmp = MANIFEST + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+
+    # Move the finished manifest into place
+    os.replace(tmp, MANIFEST)
+
+
+def collect_jobs(funcs):
+    global render_queue, batch_palette
+
+    # Collect the charts instead of drawing them
+    render_queue = []
+
+    # Look the palette up the first time a chart of the batch needs it, and reuse it for the rest
+    batch_palette = lru_cache(maxsize=None)(load_palette)
+
+    try:
+        # Loop through the chart functions
+        for func in funcs:
+            begin = len(render_queue)
+
+            # If profiling, time the function as a whole and credit its calls to it
+            if profiler is not None:
+                profiler.run(func)
+            else:
+                func()
+
+            # Record which function each chart came from
+            for job in render_queue[begin:]:
+                job['family'] = func.__name__
+        return render_queue
+    finally:
+        # Go back to drawing charts immediately
+        render_queue = None
+        batch_palette = None
+
+
+def render_jobs(units, workers=None):
+    # If only one worker is requested, render in this process
+    if workers == 1:
+        return [render_file(unit) for unit in units]
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    # Use every core by default
+    workers = workers or os.cpu_count() or 1
+    # Hand out the files in a few chunks per worker
+    chunksize = max(1, len(units) // (workers * 4))
+
+    # Render the files across a pool of processes
+    with ProcessPoolExecutor(workers, initializer=init_worker) as pool:
+        return list(pool.map(render_file, units, chunksize=chunksize))
+
+
+def export_files(jobs, export='png'):
+    # Group the charts by the file they are written to
+    files = {}
+    for job in jobs:
+        files.setdefault(export_path(job, export), []).append(job)
+
+    # If the charts are drawn as tiles, split families too large for one page into numbered pages
+    if export == 'tiles':
+        pages = {}
+        for path, group in files.items():
+            if len(group) <= TILES_PER_PAGE:
+                pages[path] = group
+                continue
+            for i in range(0, len(group), TILES_PER_PAGE):
+                pages['%s_%d.png' % (os.path.splitext(path)[0], i // TILES_PER_PAGE + 1)] = group[i:i + TILES_PER_PAGE]
+        files = pages
+
+    return files
+
+
+def update_charts(jobs, workers=None, force=False, dry_run=False, export='png'):
+    # Group the charts by the file they are written to
+    files = export_files(jobs, export)
+
+    # Read the hashes of the files already on disk
+    manifest = read_manifest()
+    hashes = {path: file_hash(group, export) for path, group in files.items()}
+
+    # Keep only the files that are missing or out of date
+    if not force:
+        files = {path: group for path, group in files.items()
+                 if manifest.get(path) != hashes[path] or not os.path.exists(path)}
+
+    # If this is a dry run, report the files without rendering them
+    if dry_run:
+        return [(path, 0.0) for path in files]
+
+    # Render the files
+    results = render_jobs([{'path': path, 'jobs': group, 'export': export} for path, group in files.items()], workers)
+
+    # Record the hashes of the charts that were rendered
+    manifest.update((path, hashes[path]) for path, _ in results)
+    write_manifest(manifest)
+
+    return results
+
+
+def chart_name(job):
+    # Name the chart after its file
+    return os.path.splitext(os.path.basename(job['path']))[0]
+
+
+def data_version():
+    # Identify the data by the state of every file the chart functions read
+    h = hashlib.sha1()
+    for fname in sorted(glob.glob('data/*.xlsx') + glob.glob(COUNTS)):
+        h.update(repr((fname, file_stamp(fname))).encode())
+    return h.hexdigest()
+
+
+def pie_image(name, chart, export='png'):
+    # Collect the charts of the function and find the one requested
+    jobs = [job for job in collect_jobs([CHARTS[name]]) if chart_name(job) == chart]
+    if not jobs:
+        raise LookupError('%s has no chart named %r' % (name, chart))
+
+    # Draw the chart and encode it
+    get_renderer().pie(jobs[0])
+    return get_renderer().encode(export)
+
+
+def bar_image(name, selected, top=2, export='png'):
+    # Only the compared chart families have pivoted counts
+    if name not in COMPARED:
+        raise LookupError('%s cannot be compared, expected one of %s' % (name, ', '.join(sorted(COMPARED))))
+
+    # Draw the comparison and encode it
+    draw_bar(COMPARED[name], list(selected), top)
+    return get_renderer().encode(export)
+
+
+def chart_data(func, name=None):
+    # Collect the charts of the function without drawing them, one request at a time
+    with collect_lock:
+        jobs = collect_jobs([func])
+
+    # Keep the name, title, labels and values of each chart
+    charts = [{'name': chart_name(job), 'title': job['title'], 'labels': job['labels'],
+               'values': job['values'].tolist()} for job in jobs]
+
+    # Keep only the requested chart
+    if name is not None:
+        charts = [chart for chart in charts if chart['name'] == name]
+
+    return charts
+
+
+def chart_frame(charts):
+    # List every slice of every chart, one per row
+    return pd.DataFrame([(chart['name'], chart['title'], label, value) for chart in charts
+                         for label, value in zip(chart['labels'], chart['values'])],
+                        columns=['chart', 'title', 'label', 'value'])
+
+
+def chart_arrow(charts):
+    # Arrow requires pyarrow
+    if feather is None:
+        raise ImportError('pyarrow is not installed')
+
+    import pyarrow as pa
+
+    # Convert the slices to an Arrow table
+    table = pa.Table.from_pandas(chart_frame(charts), preserve_index=False)
+
+    # Write the table in the Arrow streaming format
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+
+    return sink.getvalue().to_pybytes()
 
 
 def loc_by_pct():
@@ -142,10 +1234,10 @@ def adult_by_fail():
 
 def prov_by_food_pct():
     # Read data
-    df = pd.read_excel('data/prov_by_food_test.xlsx')
+    df = read_data('data/prov_by_food_test.xlsx')
 
     # Group by province and calculate the sum
-    df = df.groupby('data_source_province', as_index=False).sum(numeric_only=True)
+    df = df.groupby('data_source_province', as_index=False, observed=True).sum(numeric_only=True)
 
     # Combine values that are a small portion of the total
     df = create_other_category(df, 'data_source_province', 'orig_f_perc')
@@ -157,10 +1249,10 @@ def prov_by_food_pct():
 
 def prov_by_food_count():
     # Read data
-    df = pd.read_excel('data/prov_by_food_test.xlsx')
+    df = read_data('data/prov_by_food_test.xlsx')
 
     # Group by province and calculate the sum
-    df = df.groupby('data_source_province', as_index=False).sum(numeric_only=True)
+    df = df.groupby('data_source_province', as_index=False, observed=True).sum(numeric_only=True)
 
     # Combine values that are a small portion of the total
     df = create_other_category(df, 'data_source_province', 'orig_count')
@@ -189,6 +1281,15 @@ def capitalize(s):
     return ' '.join([_.capitalize() for _ in s.split()])
 
 
+@lru_cache(maxsize=None)
+def get_pluralizer():
+    from pluralizer import Pluralizer
+
+    # Build the pluralizer's rule tables once
+    return Pluralizer()
+
+
+@lru_cache(maxsize=LABEL_CACHE_SIZE)
 def format(s):
     # Remove underscores
     s = ' '.join(s.split('_'))
@@ -202,19 +1303,19 @@ def format(s):
     # Split the title into words
     words = s.split()
 
+    # Count how often each word appears
+    counts = Counter(words)
+
     # Loop through each word
-    for word in words:
+    for i, word in enumerate(words):
         # If that word repeats
-        if words.count(word) > 1:
-            # Find the index of the word
-            i = words.index(word)
-            # Remove the repeated words
-            new_words = words[:i + 1]
-            # Update the new words
-            words = list(new_words)
+        if counts[word] > 1:
+            # Remove the words after its first occurrence
+            words = words[:i + 1]
+            break
 
     # Pluralize the last word
-    last = Pluralizer().pluralize(words[-1])
+    last = get_pluralizer().pluralize(words[-1])
 
     # Replace the last word
     words[-1] = ''.join(last)
@@ -226,20 +1327,14 @@ def format(s):
 
 
 def food_by_adult():
-    # Read data
-    df = get_data(food_by_adult)
+    # Retrieve the counts
+    model = get_food_model()
 
-    # Retrieve first column
-    col1 = df.columns[0]
+    # Combine values that are a small portion of the total of every column
+    slices = create_other_matrix(model['food_adult'], model['fa_foods'])
 
     # Loop through the columns
-    for curr_col in df.columns[1:]:
-        # Retrieve the 2 columns
-        df2 = df[[col1, curr_col]]
-
-        # Combine values that are a small portion of the total
-        df2 = create_other_category(df2, col1, curr_col)
-
+    for curr_col, (labels, values) in zip(model['fa_adults'], slices):
         # Capitalize the current column
         title = capitalize(curr_col)
 
@@ -250,32 +1345,18 @@ def food_by_adult():
         fname = 'food_by_%s' % col_name
 
         # Create a pie chart
-        pie_cht(df2, 'Distribution of Food Types by %s' % title, fname, col1, curr_col, food_by_adult)
-
-    return df
+        pie_data(labels, values, 'Distribution of Food Types by %s' % title, fname, food_by_adult)
 
 
 def adult_in_food():
-    # Read data
-    df = get_data(food_by_adult)
-
-    # Loop through the rows
-    for _, row in df.iterrows():
-        # Create a new DataFrame
-        df2 = pd.DataFrame(row).reset_index()
+    # Retrieve the counts
+    model = get_food_model()
 
-        # Set the column names
-        df2.columns = ['x', 'y']
-
-        # Retrieve the food
-        food = df2['y'][0]
-
-        # Remove the first row
-        df2 = df2.iloc[1:]
-
-        # Combine values that are a small portion of the total
-        df2 = create_other_category(df2, 'x', 'y')
+    # Combine values that are a small portion of the total of every row
+    slices = create_other_matrix(model['food_adult'], model['fa_adults'], axis=1)
 
+    # Loop through the rows
+    for food, (labels, row) in zip(model['fa_foods'], slices):
         # Retrieve the title
         title = format(food)
 
@@ -286,34 +1367,18 @@ def adult_in_food():
         fname = 'adult_in_%s' % row_name
 
         # Create a pie chart
-        pie_cht(df2, 'Distribution of Adulterant Types in %s' % title, fname, 'x', 'y', adult_in_food)
-
-    return df
+        pie_data(labels, row, 'Distribution of Adulterant Types in %s' % title, fname, adult_in_food)
 
 
 def prov_by_food():
-    # Read data
-    df = pd.read_excel('data/prov_by_food_adult.xlsx')
+    # Retrieve the counts
+    model = get_prov_model()
 
-    # Group by province and calculate the sum
-    df = df.groupby('level_1', as_index=False).sum(numeric_only=True)
-
-    # Retrieve first column
-    col1 = df.columns[0]
+    # Combine values that are a small portion of the total of every column
+    slices = create_other_matrix(model['prov_food'], model['provinces'])
 
     # Loop through the columns
-    for curr_col in df.columns[1:]:
-
-        # Stop once adulterants are reached
-        if 'contaminant' in curr_col.lower():
-            return
-
-        # Retrieve the 2 columns
-        df2 = df[[col1, curr_col]]
-
-        # Combine values that are a small portion of the total
-        df2 = create_other_category(df2, col1, curr_col)
-
+    for curr_col, (labels, values) in zip(model['foods'], slices):
         # Retrieve the title
         title = format(curr_col)
 
@@ -324,48 +1389,18 @@ def prov_by_food():
         fname = 'prov_by_%s' % col_name
 
         # Create a pie chart
-        pie_cht(df2, 'Distribution of Provinces by %s' % title, fname, col1, curr_col, prov_by_food)
-
-    # Transpose the DataFrame
-    df = df.T
-
-    # Delete the first row
-    df = df.iloc[1:]
-
-    # Reset the index
-    df.reset_index(inplace=True)
-
-    return df
+        pie_data(labels, values, 'Distribution of Provinces by %s' % title, fname, prov_by_food)
 
 
 def food_in_prov():
-    # Read data
-    df = pd.read_excel('data/prov_by_food_adult.xlsx')
+    # Retrieve the counts
+    model = get_prov_model()
 
-    # Group by province and calculate the sum
-    df = df.groupby('level_1', as_index=False).sum(numeric_only=True)
+    # Combine values that are a small portion of the total of every row
+    slices = create_other_matrix(model['prov_food'], model['foods'], axis=1)
 
     # Loop through the rows
-    for _, row in df.iterrows():
-        # Create a new DataFrame
-        df2 = pd.DataFrame(row).reset_index()
-
-        # Set the column names
-        df2.columns = ['x', 'y']
-
-        # Retrieve the food
-        food = df2['y'][0]
-
-        # Stop once adulterants are reached
-        if 'contaminant' in food.lower():
-            return
-
-        # Remove the first rows
-        df2 = df2.iloc[2:]
-
-        # Combine values that are a small portion of the total
-        df2 = create_other_category(df2, 'x', 'y')
-
+    for food, (labels, row) in zip(model['provinces'], slices):
         # Capitalize the current column
         title = capitalize(food)
 
@@ -376,32 +1411,18 @@ def food_in_prov():
         fname = 'food_in_%s' % col_name
 
         # Create a pie chart
-        pie_cht(df2, 'Distribution of Food Types in %s' % title, fname, 'x', 'y', food_in_prov)
-
-    return df
+        pie_data(labels, row, 'Distribution of Food Types in %s' % title, fname, food_in_prov)
 
 
 def prov_by_adult():
-    # Read data
-    df = pd.read_excel('data/prov_by_food_adult.xlsx')
-
-    # Group by province and calculate the sum
-    df = df.groupby('level_1', as_index=False).sum(numeric_only=True)
+    # Retrieve the counts
+    model = get_prov_model()
 
-    # Retrieve first column
-    col1 = df.columns[0]
-
-    # Find the index of the column header containing 'contaminant'
-    idx = df.columns.get_loc(df.columns[df.columns.str.contains('contaminant')][0])
+    # Combine values that are a small portion of the total of every column
+    slices = create_other_matrix(model['prov_adult'], model['provinces'])
 
     # Loop through the columns
-    for curr_col in df.columns[idx:]:
-        # Retrieve the 2 columns
-        df2 = df[[col1, curr_col]]
-
-        # Combine values that are a small portion of the total
-        df2 = create_other_category(df2, col1, curr_col)
-
+    for curr_col, (labels, values) in zip(model['adults'], slices):
         # Retrieve the title
         title = format(curr_col)
 
@@ -412,50 +1433,18 @@ def prov_by_adult():
         fname = 'prov_by_%s' % col_name
 
         # Create a pie chart
-        pie_cht(df2, 'Distribution of Provinces by %s' % title, fname, col1, curr_col, prov_by_adult)
-
-    # Set the index as the first column
-    df.set_index(col1, inplace=True)
-
-    # Slice the DataFrame
-    df = df.iloc[:, idx - 1:]
-
-    # Transpose the DataFrame
-    df = df.T
-
-    # Reset the index
-    df.reset_index(inplace=True)
-
-    return df
+        pie_data(labels, values, 'Distribution of Provinces by %s' % title, fname, prov_by_adult)
 
 
 def adult_in_prov():
-    # Read data
-    df = pd.read_excel('data/prov_by_food_adult.xlsx')
+    # Retrieve the counts
+    model = get_prov_model()
 
-    # Group by province and calculate the sum
-    df = df.groupby('level_1', as_index=False).sum(numeric_only=True)
+    # Combine values that are a small portion of the total of every row
+    slices = create_other_matrix(model['prov_adult'], model['adults'], axis=1)
 
     # Loop through the rows
-    for _, row in df.iterrows():
-        # Create a new DataFrame
-        df2 = pd.DataFrame(row).reset_index()
-
-        # Set the column names
-        df2.columns = ['x', 'y']
-
-        # Retrieve the food
-        food = df2['y'][0]
-
-        # Find the index of the cell containing 'contaminant'
-        idx = df2[df2['x'].str.contains('contaminant')].index[0]
-
-        # Remove the first rows
-        df2 = df2.iloc[idx:]
-
-        # Combine values that are a small portion of the total
-        df2 = create_other_category(df2, 'x', 'y')
-
+    for food, (labels, row) in zip(model['provinces'], slices):
         # Capitalize the current column
         title = capitalize(food)
 
@@ -466,183 +1455,165 @@ def adult_in_prov():
         fname = 'adult_in_%s' % col_name
 
         # Create a pie chart
-        pie_cht(df2, 'Distribution of Adulterant Types in %s' % title, fname, 'x', 'y', adult_in_prov)
-
-    return df
+        pie_data(labels, row, 'Distribution of Adulterant Types in %s' % title, fname, adult_in_prov)
 
 
 def adult_in_all_food():
-    # Read data
-    df = get_data(food_by_adult)
-
-    # Find the sum of each column
-    df = df.sum().reset_index()
-
-    # Set the column names
-    df.columns = ['x', 'y']
+    # Retrieve the counts
+    model = get_food_model()
 
-    # Remove the first rows
-    df = df.iloc[2:]
-
-    # Combine location types that are a small portion of the total
-    df = create_other_category(df, 'x', 'y')
+    # Combine adulterant types that are a small portion of the total
+    labels, values = create_other_matrix(model['adult_in_all_food'][:, None], model['fa_adults'])[0]
 
     # Create a pie chart
-    pie_cht(df, 'Distribution of Adulterant Types in All Food', adult_in_all_food.__name__, 'x', 'y')
+    pie_data(labels, values, 'Distribution of Adulterant Types in All Food', adult_in_all_food.__name__)
 
 
 def food_by_all_adult():
-    # Read data
-    df = get_data(food_by_adult)
+    # Retrieve the counts
+    model = get_food_model()
 
-    # Set the index
-    df.set_index('prod_category_english_nn', inplace=True)
-
-    # Find the sum of each row
-    df = df.sum(axis=1).reset_index()
-
-    # Set the column names
-    df.columns = ['x', 'y']
-
-    # Combine location types that are a small portion of the total
-    df = create_other_category(df, 'x', 'y')
+    # Combine food types that are a small portion of the total
+    labels, values = create_other_matrix(model['food_by_all_adult'][:, None], model['fa_foods'])[0]
 
     # Create a pie chart
-    pie_cht(df, 'Distribution of Food Types by All Adulterants', food_by_all_adult.__name__, 'x', 'y')
+    pie_data(labels, values, 'Distribution of Food Types by All Adulterants', food_by_all_adult.__name__)
 
 
 def food_by_all_prov():
-    # Read data
-    df = pd.read_excel('data/prov_by_food_adult.xlsx')
-
-    # Group by province and calculate the sum
-    df = df.groupby('level_1', as_index=False).sum(numeric_only=True)
-
-    # Find the sum of each column
-    df = df.sum().reset_index()
+    # Retrieve the counts
+    model = get_prov_model()
 
-    # Set the column names
-    df.columns = ['x', 'y']
-
-    # Remove the first row
-    df = df.iloc[1:]
-
-    # Combine location types that are a small portion of the total
-    df = create_other_category(df, 'x', 'y')
+    # Combine food types that are a small portion of the total
+    labels, values = create_other_matrix(model['food_by_all_prov'][:, None], model['foods'])[0]
 
     # Create a pie chart
-    pie_cht(df, 'Distribution of Food Types by All Provinces', food_by_all_prov.__name__, 'x', 'y')
+    pie_data(labels, values, 'Distribution of Food Types by All Provinces', food_by_all_prov.__name__)
 
 
 def prov_by_all_food():
-    # Read data
-    df = pd.read_excel('data/prov_by_food_adult.xlsx')
+    # Retrieve the counts
+    model = get_prov_model()
 
-    # Group by province and calculate the sum
-    df = df.groupby('level_1', as_index=False).sum(numeric_only=True)
-
-    # Set the index
-    df.set_index('level_1', inplace=True)
+    # Combine provinces that are a small portion of the total
+    labels, values = create_other_matrix(model['prov_by_all_food'][:, None], model['provinces'])[0]
 
-    # Find the sum of each row
-    df = df.sum(axis=1).reset_index()
+    # Create a pie chart
+    pie_data(labels, values, 'Distribution of Provinces by All Foods', prov_by_all_food.__name__)
 
-    # Set the column names
-    df.columns = ['x', 'y']
 
-    # Remove the first row
-    df = df.iloc[1:]
+def adult_in_all_prov():
+    # Retrieve the counts
+    model = get_prov_model()
 
-    # Combine location types that are a small portion of the total
-    df = create_other_category(df, 'x', 'y')
+    # Combine adulterant types that are a small portion of the total
+    labels, values = create_other_matrix(model['adult_in_all_prov'][:, None], model['adults'])[0]
 
     # Create a pie chart
-    pie_cht(df, 'Distribution of Provinces by All Foods', prov_by_all_food.__name__, 'x', 'y')
+    pie_data(labels, values, 'Distribution of Adulterant Types in All Provinces', adult_in_all_prov.__name__)
 
 
-def adult_in_all_prov():
-    # Read data
-    df = pd.read_excel('data/prov_by_food_adult.xlsx')
+def prov_by_all_adult():
+    # Retrieve the counts
+    model = get_prov_model()
 
-    # Group by province and calculate the sum
-    df = df.groupby('level_1', as_index=False).sum(numeric_only=True)
+    # Combine provinces that are a small portion of the total
+    labels, values = create_other_matrix(model['prov_by_all_adult'][:, None], model['provinces'])[0]
 
-    # Find the index of the column header containing 'contaminant'
-    idx = df.columns.get_loc(df.columns[df.columns.str.contains('contaminant')][0])
+    # Create a pie chart
+    pie_data(labels, values, 'Distribution of Provinces by All Adulterants', prov_by_all_adult.__name__)
 
-    # Slice the DataFrame
-    df = df.iloc[:, idx:]
 
-    # Find the sum of each column
-    df = df.sum().reset_index()
+def read_labels():
+    global labels
 
-    # Set the column names
-    df.columns = ['x', 'y']
+    # Read the saved options the first time they are needed
+    with labels_lock:
+        if labels is None:
+            try:
+                with open(LABELS) as f:
+                    labels = json.load(f)
+            except (OSError, ValueError):
+                labels = {'files': {}, 'names': {}}
 
-    # Remove the first row
-    df = df.iloc[1:]
+    return labels
 
-    # Combine location types that are a small portion of the total
-    df = create_other_category(df, 'x', 'y')
 
-    # Create a pie chart
-    pie_cht(df, 'Distribution of Adulterant Types in All Provinces', adult_in_all_prov.__name__, 'x', 'y')
+def write_labels():
+    # Create the folder for the options
+    os.makedirs(os.path.dirname(LABELS), exist_ok=True)
 
+    # Write to a temporary file so a partial list is never read
+    tmp = LABELS + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(labels, f)
 
-def prov_by_all_adult():
-    # Read data
-    df = pd.read_excel('data/prov_by_food_adult.xlsx')
+    # Move the finished list into place
+    os.replace(tmp, LABELS)
 
-    # Group by province and calculate the sum
-    df = df.groupby('level_1', as_index=False).sum(numeric_only=True)
 
-    # Find the index of the column header containing 'contaminant'
-    idx = df.columns.get_loc(df.columns[df.columns.str.contains('contaminant')][0])
+def get_labels(func):
+    # Get file name
+    fname = 'data/%s.xlsx' % func.__name__
+    # Retrieve the current state of the file
+    stamp = list(file_stamp(fname))
 
-    # Slice the DataFrame
-    df = pd.concat([df.iloc[:, 0], df.iloc[:, idx:]], axis=1)
+    # Retrieve the saved options of the file, without waiting for any workbook being parsed
+    entry = read_labels()['files'].get(fname)
 
-    # Set the index
-    df.set_index('level_1', inplace=True)
+    # If the options have not been saved yet or the file has changed since
+    if entry is None or entry['stamp'] != stamp:
+        # Read data, waiting only if another thread is reading the same workbook
+        df = get_data(func)
 
-    # Find the sum of each row
-    df = df.sum(axis=1).reset_index()
+        # Keep the first column along with the formatted names of its options
+        entry = {'stamp': stamp, 'labels': df[df.columns[0]].tolist()}
+        names = {label: format(label) for label in entry['labels']}
 
-    # Set the column names
-    df.columns = ['x', 'y']
+        # Save them, one thread at a time
+        with labels_lock:
+            labels['files'][fname] = entry
+            labels['names'].update(names)
 
-    # Remove the first row
-    df = df.iloc[1:]
+            try:
+                write_labels()
+            except OSError:
+                # Carry on without saving them if the folder is not writable
+                pass
 
-    # Combine location types that are a small portion of the total
-    df = create_other_category(df, 'x', 'y')
+    return list(entry['labels'])
 
-    # Create a pie chart
-    pie_cht(df, 'Distribution of Provinces by All Adulterants', prov_by_all_adult.__name__, 'x', 'y')
 
+def label_name(label):
+    # Use the saved name of the option, which does not require building the pluralizer
+    return read_labels()['names'].get(label) or format(label)
 
-def get_all_adults():
-    # Read data
-    df = get_data(adult_by_fail)
 
+def get_all_adults():
     # Return the first column
-    return list(df[df.columns[0]])
+    return get_labels(adult_by_fail)
 
 
 def get_all_foods():
-    # Read data
-    df = get_data(food_by_fail)
-
     # Return the first column
-    return list(df[df.columns[0]])
+    return get_labels(food_by_fail)
 
 
 def get_all_provinces():
-    # Read data
-    df = get_data(prov_by_recs)
-
     # Return the first column
-    return list(df[df.columns[0]])
+    return get_labels(prov_by_recs)
+
+
+def label_table():
+    # Collect every food, adulterant and province
+    labels = get_all_foods() + get_all_adults() + get_all_provinces()
+
+    # Include the labels of the counts
+    model = get_model()
+    labels += model['fa_foods'] + model['fa_adults'] + model['foods'] + model['adults']
+
+    # Format each label once, filling the cache used by every later call
+    return {label: format(label) for label in labels}
 
 
 def error(msg):
@@ -654,16 +1625,16 @@ def error(msg):
 def print_options(options, type):
     usr = ''
     while not usr:
-        print('Choose 2 %s:\n' % type)
+        print('Choose 2 or more %s:\n' % type)
         # Loop through the options
         for i, option in enumerate(options):
             if type != 'provinces':
                 # Format the option
-                option = format(option)
+                option = label_name(option)
             # Print the option
             print('%s. %s' % (i + 1, option))
 
-        usr = input('\nEnter the number of the 2 %s to compare, separated by a space: ' % type)
+        usr = input('\nEnter the numbers of the %s to compare, separated by spaces: ' % type)
 
         # Clean the input
         usr = usr.strip()
@@ -671,10 +1642,10 @@ def print_options(options, type):
         # Split the input
         usr = usr.split()
 
-        # Check if there are 2 numbers
-        if len(usr) != 2:
+        # Check if there are at least 2 numbers
+        if len(usr) < 2:
             usr = ''
-            error('Please enter 2 numbers separated by a space.')
+            error('Please enter 2 or more numbers separated by spaces.')
             continue
 
         try:
@@ -687,23 +1658,22 @@ def print_options(options, type):
             # Check if the numbers are within the range
             if not all(num in rng for num in usr):
                 usr = ''
-                error('Please enter 2 valid numbers from 1 to %s.' % len(options))
+                error('Please enter valid numbers from 1 to %s.' % len(options))
                 continue
 
-            # Check if the numbers are not the same
-            if usr[0] == usr[1]:
+            # Check if the numbers are all different
+            if len(set(usr)) != len(usr):
                 usr = ''
-                error('Please enter 2 different numbers.')
+                error('Please enter different numbers.')
                 continue
 
-
-        except:
+        except ValueError:
             usr = ''
-            error('Please enter 2 numbers separated by a space.')
+            error('Please enter 2 or more numbers separated by spaces.')
             continue
 
-    # Retrieve the options chosen
-    options = [option for i, option in enumerate(options) if i + 1 in usr]
+    # Retrieve the options chosen, in the order they were entered
+    options = [options[num - 1] for num in usr]
 
     return options
 
@@ -716,121 +1686,205 @@ def get_type(usr):
     return 'provinces'
 
 
-def bar_cht(func, selected):
-    # Read data
-    df = func()
+def pivot_data(name):
+    # Retrieve only the counts the chart family compares
+    model = get_food_model() if name in ['adult_in_food', 'food_by_adult'] else get_prov_model()
+
+    # Arrange the counts so the categories being compared are the columns
+    if name == 'adult_in_food':
+        df = pd.DataFrame(model['food_adult'], index=model['fa_foods'], columns=model['fa_adults'])
+    elif name == 'food_by_adult':
+        df = pd.DataFrame(model['food_adult'].T, index=model['fa_adults'], columns=model['fa_foods'])
+    elif name == 'prov_by_adult':
+        df = pd.DataFrame(to_dense(model['prov_adult']).T, index=model['adults'], columns=model['provinces'])
+    elif name == 'prov_by_food':
+        df = pd.DataFrame(model['prov_food'].T, index=model['foods'], columns=model['provinces'])
+    elif name in ['adult_in_prov', 'food_in_prov']:
+        counts = np.hstack([model['prov_food'], to_dense(model['prov_adult'])])
+        df = pd.DataFrame(counts, index=model['provinces'], columns=model['foods'] + model['adults'])
+    else:
+        raise LookupError('%s has no pivoted counts to compare' % name)
+
+    # If the rows do not contain provinces
+    if name not in ['adult_in_prov', 'food_in_prov']:
+        # Format the row names
+        df.index = [format(_) for _ in df.index]
+
+    return df
+
+
+def get_pivot(func):
+    # Retrieve the name of the chart family
+    name = func.__name__
+
+    # Retrieve the file the counts come from
+    if os.path.exists(COUNTS):
+        fname = COUNTS
+    elif name in ['adult_in_food', 'food_by_adult']:
+        fname = 'data/food_by_adult.xlsx'
+    else:
+        fname = 'data/prov_by_food_adult.xlsx'
+
+    # Pivot the counts once per version of the file
+    return read_data(fname, ('pivot', name), lambda _: pivot_data(name))
+
+
+def top_rows(values, top=2):
+    # At least one row of each category has to be shown
+    if top < 1:
+        raise ValueError('top must be at least 1, got %d' % top)
+
+    # Keep no more rows than there are, and none if there are none
+    top = min(top, len(values))
+    if top == 0:
+        return np.arange(0)
+
+    # Find the rows with the greatest values in every column at once
+    idx = np.argpartition(-values, top - 1, axis=0)[:top]
+
+    # Sort the rows found for each column in descending order
+    order = np.argsort(-np.take_along_axis(values, idx, axis=0), axis=0, kind='stable')
+    idx = np.take_along_axis(idx, order, axis=0)
+
+    # List the rows column by column, keeping only the first time each row appears
+    idx = idx.ravel(order='F')
+    _, first = np.unique(idx, return_index=True)
 
-    # Retrieve the first column
-    col1 = df[df.columns[0]]
+    return idx[np.sort(first)]
 
-    # If the column does not contain provinces
-    if 'level' not in col1.name:
-        # Format the column
-        col1 = [format(_) for _ in list(col1)]
 
-    # Update the first column
-    df[df.columns[0]] = col1
+def join_names(names):
+    # Join the names as a list ending in 'and'
+    return ' and '.join([', '.join(names[:-1]), names[-1]]) if len(names) > 1 else ''.join(names)
 
-    # Set the first column as the index
-    df.set_index(df.columns[0], inplace=True)
+
+def draw_bar(func, selected, top=2):
+    # Read data pivoted for the chart family, without drawing any of its pie charts
+    df = get_pivot(func)
 
     # Retrieve the selected columns
     df = df.loc[:, selected]
 
-    # Clear the plot
-    plt.clf()
+    # Keep the rows with the greatest values in any of the selected columns
+    df = df.iloc[top_rows(df.to_numpy(dtype=float), top)]
 
-    # Get the top 2 rows with the greatest values in the first column
-    top2_first_col = df.nlargest(2, df.columns[0])
+    # Set the title
+    title = join_names(selected)
 
-    # Get the top 2 rows with the greatest values in the second column
-    top2_second_col = df.nlargest(2, df.columns[1])
+    # If the selected categories are not provinces
+    if func.__name__ not in ['prov_by_adult', 'prov_by_food']:
+        title = join_names([format(_) for _ in selected])
 
-    # Concatenate the two dataframes
-    df = pd.concat([top2_first_col, top2_second_col])
+    # Create a grouped bar chart
+    get_renderer().bar(df, 'Comparison of %s' % title, label_colors(selected, load_palette()))
 
-    # Drop duplicates
-    df = df.drop_duplicates()
 
-    # Create a grouped bar chart
-    bar_width = 0.4
+def bar_cht(func, selected, path=None, block=True, top=2):
+    # Draw the comparison
+    draw_bar(func, selected, top)
 
-    index = np.arange(len(df.index))
+    # If a file is requested, save the plot instead of showing it
+    if path:
+        get_renderer().save(path)
+        return
 
-    # Create the bars
-    bar1 = plt.bar(index, df[selected[0]], bar_width, label=selected[0])
-    bar2 = plt.bar(index + bar_width, df[selected[1]], bar_width, label=selected[1])
+    # Show the plot
+    plt.show(block=block)
 
-    # Set the title
-    title = ' and '.join(selected)
+    # Give a non-blocking window a moment to draw
+    if not block:
+        plt.pause(0.001)
 
+
+def choose_comparison(usr):
+    # Retrieve the function listing the options and the chart families to compare across
     try:
-        # If the column does not contain provinces
-        if 'level' not in df.iloc[0].name:
-            title = ' and '.join([format(_) for _ in selected])
-    except:
-        try:
-            # If the column does not contain provinces
-            if 'level' not in df.iloc[0].index.name:
-                title = ' and '.join([format(_) for _ in selected])
-        except:
-            pass
+        get_all, across = COMPARISONS[usr]
+    except KeyError:
+        print('Invalid input.')
+        return None
 
-    # Set the title and labels
-    plt.title('Comparison of %s' % title)
-    plt.xlabel('Category')
-    plt.ylabel('Count')
+    # Let the user choose the options to compare
+    selected = print_options(get_all(), get_type(usr))
 
-    # Set the x-axis labels
-    plt.xticks(index + bar_width / 2, df.index)
+    # Format the options unless they are provinces
+    formatted = selected if usr == 'p' else [label_name(_) for _ in selected]
 
-    # Adding legend
-    plt.legend()
+    # Ask what to compare them across
+    usr2 = input('Compare \'%s\' across %s? (%s) ' % (' & '.join(formatted), ' or '.join(get_type(_) for _ in across),
+                                                       '/'.join(across)))
 
-    # Show the plot
-    plt.show()
+    # If the answer is not one of the choices
+    if usr2 not in across:
+        print('Invalid input.')
+        return None
+
+    return across[usr2], selected
 
 
 def comp_2():
-    usr = input('Compare 2 adulterants, foods, or provinces? (a/f/p) ')
-    if usr == 'a':
-        adults = get_all_adults()
-        selected = print_options(adults, get_type(usr))
-        formatted = [format(_) for _ in selected]
-        usr2 = input('Compare \'%s\' across foods or provinces? (f/p) ' % ' & '.join(formatted))
-        if usr2 == 'f':
-            bar_cht(adult_in_food, selected)
-        elif usr2 == 'p':
-            bar_cht(adult_in_prov, selected)
-        else:
-            print('Invalid input.')
-            quit()
-    elif usr == 'f':
-        foods = get_all_foods()
-        selected = print_options(foods, get_type(usr))
-        formatted = [format(_) for _ in selected]
-        usr2 = input('Compare \'%s\' across adulterants or provinces? (a/p) ' % ' & '.join(formatted))
-        if usr2 == 'a':
-            bar_cht(food_by_adult, selected)
-        elif usr2 == 'p':
-            bar_cht(food_in_prov, selected)
-        else:
-            print('Invalid input.')
-            quit()
-    elif usr == 'p':
-        provinces = get_all_provinces()
-        selected = print_options(provinces, get_type(usr))
-        usr2 = input('Compare \'%s\' across adulterants or foods? (a/f) ' % ' & '.join(selected))
-        if usr2 == 'a':
-            bar_cht(prov_by_adult, selected)
-        elif usr2 == 'f':
-            bar_cht(prov_by_food, selected)
-        else:
-            print('Invalid input.')
-            quit()
-    else:
-        print('Invalid input.')
-        quit()
+    # Let the user choose what to compare
+    choice = choose_comparison(input('Compare adulterants, foods, or provinces? (a/f/p) '))
+
+    # Compare the choices
+    if choice:
+        bar_cht(*choice)
+
+
+def warm_up():
+    # Load the plotting library
+    plt.get_backend()
+
+    # Format every label
+    label_table()
+
+    # Read and pivot the data of every comparison
+    for _, across in COMPARISONS.values():
+        for func in across.values():
+            get_pivot(func)
+
+
+def comp_session(out=None, top=2):
+    # Read and pivot the data in the background while the user reads the menu
+    threading.Thread(target=warm_up, daemon=True).start()
+
+    # Count the charts drawn
+    count = 0
+
+    # Report how long the program took to be ready
+    print('Ready in %.3fs.\n' % (time.perf_counter() - STARTED))
+
+    while True:
+        usr = input('Compare adulterants, foods, or provinces? (a/f/p, or q to quit) ')
+
+        # Stop once the user is done
+        if usr == 'q':
+            return
+
+        # Let the user choose what to compare
+        choice = choose_comparison(usr)
+
+        # Start over if the input is invalid
+        if not choice:
+            print()
+            continue
+
+        # Start the timer
+        start = time.perf_counter()
+
+        # Set the file name if the charts are saved
+        count += 1
+        path = os.path.join(out, 'comparison_%d.png' % count) if out else None
+
+        # If the charts are shown, draw them in a window that does not block
+        if not out:
+            plt.ion()
+
+        # Compare the choices
+        bar_cht(*choice, path=path, block=False, top=top)
+
+        # Report the time taken
+        print('Drew %s in %.3fs.\n' % (path or 'the chart', time.perf_counter() - start))
 
 
 def prov_by_cnt():
@@ -838,7 +1892,7 @@ def prov_by_cnt():
     df = get_data(prov_by_cnt)
 
     # Group by province and calculate the sum
-    df = df.groupby('data_source_province', as_index=False).sum(numeric_only=True)
+    df = df.groupby('data_source_province', as_index=False, observed=True).sum(numeric_only=True)
 
     # Combine the category names
     df = rename_categories(df)
@@ -849,3 +1903,336 @@ def prov_by_cnt():
     # Create a pie chart
     pie_cht(df, 'Distribution of Provinces by New Count', prov_by_cnt.__name__, 'data_source_province',
             'new_count')
+
+
+# Every chart function, in the order the charts are generated
+CHARTS = {func.__name__: func for func in [
+    loc_by_pct, food_by_pct, adult_by_pct, food_by_fail, adult_by_fail, prov_by_food_pct, prov_by_food_count,
+    prov_by_recs, prov_by_cnt, food_by_adult, adult_in_food, prov_by_food, food_in_prov, prov_by_adult,
+    adult_in_prov, adult_in_all_food, food_by_all_adult, food_by_all_prov, prov_by_all_food, adult_in_all_prov,
+    prov_by_all_adult,
+]}
+
+
+# The function listing each type of option and the chart families it can be compared across
+COMPARISONS = {
+    'a': (get_all_adults, {'f': adult_in_food, 'p': adult_in_prov}),
+    'f': (get_all_foods, {'a': food_by_adult, 'p': food_in_prov}),
+    'p': (get_all_provinces, {'a': prov_by_adult, 'f': prov_by_food}),
+}
+
+# Every chart family whose categories can be compared, by name
+COMPARED = {func.__name__: func for _, across in COMPARISONS.values() for func in across.values()}
+
+
+def select_charts(patterns):
+    # Retrieve the chart functions whose names match any of the patterns
+    return [func for name, func in CHARTS.items() if any(fnmatch(name, pattern) for pattern in patterns)]
+
+
+class Profiler:
+    def __init__(self, memory=False):
+        # Whether to track the peak memory of each call, which slows every allocation
+        self.memory = memory
+
+        # Calls, seconds, seconds outside nested calls and peak bytes, keyed by chart function and stage
+        self.stats = {}
+
+        # Every call, in the Chrome trace event format
+        self.events = []
+
+        # Chart function being run, which every call is credited to
+        self.chart = None
+
+        # Calls in progress in each thread
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+        # Functions replaced while profiling
+        self.originals = {}
+
+        # Time the trace starts from
+        self.origin = time.perf_counter()
+
+    def start(self):
+        # Replace each profiled function with one that times it, so nothing is timed once profiling stops
+        for name in PROFILED:
+            self.originals[name] = globals()[name]
+            globals()[name] = self.wrap(name, self.originals[name])
+
+        # Start tracking memory if requested
+        if self.memory:
+            tracemalloc.start()
+
+    def stop(self):
+        # Put the original functions back
+        globals().update(self.originals)
+        self.originals = {}
+
+        # Stop tracking memory
+        if self.memory:
+            tracemalloc.stop()
+
+    def wrap(self, stage, func):
+        @wraps(func)
+        def timed(*args, **kwargs):
+            self.enter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.leave(stage)
+
+        return timed
+
+    def stack(self):
+        # Retrieve the calls in progress in this thread
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+        return self.local.stack
+
+    def enter(self):
+        stack = self.stack()
+        call = {'child': 0.0, 'peak': 0}
+
+        # If tracking memory, measure the peak of this call from the memory in use now
+        if self.memory:
+            current, peak = tracemalloc.get_traced_memory()
+
+            # Hand the peak so far to the enclosing call before starting a new one
+            if stack:
+                stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+            tracemalloc.reset_peak()
+            call['base'] = current
+
+        # Start the timer last so the bookkeeping is not timed
+        call['start'] = time.perf_counter()
+        stack.append(call)
+
+    def leave(self, stage):
+        end = time.perf_counter()
+        stack = self.stack()
+        call = stack.pop()
+        seconds = end - call['start']
+        peak = 0
+
+        # If tracking memory, find the highest memory in use during the call
+        if self.memory:
+            top = max(call['peak'], tracemalloc.get_traced_memory()[1])
+            peak = top - call['base']
+
+            # Let the enclosing call know about it
+            if stack:
+                stack[-1]['peak'] = max(stack[-1]['peak'], top)
+
+        # Take the call's time out of the enclosing call's own time
+        if stack:
+            stack[-1]['child'] += seconds
+
+        self.add(self.chart, stage, seconds, seconds - call['child'], peak)
+
+        # Record the call in the trace
+        with self.lock:
+            self.events.append({'name': stage, 'cat': self.chart or '-', 'ph': 'X', 'pid': os.getpid(),
+                                'tid': threading.get_ident(), 'ts': (call['start'] - self.origin) * 1e6,
+                                'dur': seconds * 1e6})
+
+    def add(self, chart, stage, seconds, own=None, peak=0):
+        # Add the call to the totals of its chart function and stage
+        with self.lock:
+            stats = self.stats.setdefault((chart or '-', stage), [0, 0.0, 0.0, 0])
+            stats[0] += 1
+            stats[1] += seconds
+            stats[2] += seconds if own is None else own
+            stats[3] = max(stats[3], peak)
+
+    def run(self, func):
+        # Credit every call made by the chart function to it
+        self.chart = func.__name__
+
+        try:
+            # Time the chart function as a whole
+            self.wrap('total', func)()
+        finally:
+            self.chart = None
+
+    def rows(self):
+        # List the totals of each chart function and stage
+        return [{'chart': chart, 'stage': stage, 'calls': calls, 'seconds': seconds, 'own': own, 'peak': peak}
+                for (chart, stage), (calls, seconds, own, peak) in sorted(self.stats.items())]
+
+    def summary(self):
+        lines = ['%-20s %-22s %7s %10s %10s %10s' % ('function', 'stage', 'calls', 'seconds', 'own', 'peak MB')]
+
+        # Add a line for each chart function and stage
+        for row in self.rows():
+            lines.append('%-20s %-22s %7d %9.4fs %9.4fs %10s' % (
+                row['chart'], row['stage'], row['calls'], row['seconds'], row['own'],
+                '%.2f' % (row['peak'] / 2 ** 20) if self.memory else '-'))
+
+        return '\n'.join(lines)
+
+    def write_json(self, path):
+        # Write the totals of each chart function and stage
+        with open(path, 'w') as f:
+            json.dump({'memory': self.memory, 'stats': self.rows()}, f, indent=1)
+
+    def write_trace(self, path):
+        # Write every call in a form chrome://tracing and Perfetto can open
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms'}, f)
+
+
+def start_profiling(memory=False):
+    global profiler
+
+    # Start timing the profiled functions
+    profiler = Profiler(memory)
+    profiler.start()
+
+    return profiler
+
+
+def stop_profiling():
+    global profiler
+
+    # Stop timing the profiled functions
+    profiler.stop()
+    done, profiler = profiler, None
+
+    return done
+
+
+def run_charts(funcs, workers=None, force=False, dry_run=False, export='png'):
+    # Start the timer
+    start = time.perf_counter()
+
+    # Collect the charts of each function, timing the data processing
+    jobs = []
+    families = {}
+    for func in funcs:
+        begin = time.perf_counter()
+        found = collect_jobs([func])
+        families[func.__name__] = {'charts': len(found), 'process': time.perf_counter() - begin, 'render': 0.0,
+                                   'written': 0}
+        jobs += found
+
+    # Remember which function each file came from
+    family = {path: group[0]['family'] for path, group in export_files(jobs, export).items()}
+
+    # Render the files that are out of date
+    results = update_charts(jobs, workers, force, dry_run, export)
+
+    # Report each chart
+    for path, seconds in results:
+        print('%s %8.3fs  %s' % ('would write' if dry_run else 'wrote', seconds, path))
+        families[family[path]]['render'] += seconds
+        families[family[path]]['written'] += 1
+
+        # Credit the rendering, which may have happened in another process, to the chart function
+        if profiler is not None and not dry_run:
+            profiler.add(family[path], 'render', seconds)
+
+    # Report each function
+    print('\n%-20s %7s %8s %10s %10s' % ('function', 'charts', 'written', 'process', 'render'))
+    for name, stats in families.items():
+        print('%-20s %7d %8d %9.3fs %9.3fs' % (name, stats['charts'], stats['written'], stats['process'],
+                                               stats['render']))
+
+    # Report the total
+    print('\n%d of %d files %s in %.3fs' % (len(results), len(family), 'out of date' if dry_run else 'written',
+                                            time.perf_counter() - start))
+
+
+def positive_int(value):
+    # Accept only whole numbers of at least 1
+    try:
+        n = int(value)
+    except ValueError:
+        n = 0
+    if n < 1:
+        raise argparse.ArgumentTypeError('expected a whole number of at least 1, got %r' % value)
+    return n
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate the charts in the charts directory.')
+    parser.add_argument('charts', nargs='*', default=['*'],
+                        help='names or glob patterns of the chart functions to run (default: all)')
+    parser.add_argument('-n', '--dry-run', action='store_true',
+                        help='list the charts that would be written without rendering them')
+    parser.add_argument('-f', '--force', action='store_true', help='render charts even if they are up to date')
+    parser.add_argument('-j', '--workers', type=positive_int, default=None,
+                        help='number of processes to render with (default: one per core)')
+    parser.add_argument('-e', '--export', choices=list(EXPORTS), default='png',
+                        help='write charts as PNG, PNG compressed less (fast), PNG encoded straight from the drawn '
+                             'pixels (buffer), SVG, one multi-page PDF per chart function, or pages of tiles per '
+                             'chart function (default: png)')
+    parser.add_argument('-c', '--compare', action='store_true', help='compare categories interactively instead')
+    parser.add_argument('-k', '--top', type=positive_int, default=2,
+                        help='with --compare, show the top K rows of each category compared (default: 2)')
+    parser.add_argument('-o', '--out',
+                        help='with --compare, save the comparisons in this folder instead of showing them')
+    parser.add_argument('-l', '--list', action='store_true', help='list the chart functions and exit')
+    parser.add_argument('-p', '--profile', action='store_true',
+                        help='report the time spent in each stage of each chart function')
+    parser.add_argument('--profile-memory', action='store_true',
+                        help='with --profile, also report the peak memory of each stage (slower)')
+    parser.add_argument('--profile-json', metavar='FILE', help='write the profile to this JSON file')
+    parser.add_argument('--profile-trace', metavar='FILE',
+                        help='write every profiled call to this Chrome trace file (chrome://tracing or Perfetto)')
+    parser.add_argument('--cprofile', metavar='FILE', help='write cProfile statistics of the run to this file')
+    parser.add_argument('-m', '--memory', action='store_true',
+                        help='report the memory each table, model and pivot takes at full width and as kept')
+    args = parser.parse_args(argv)
+
+    # Retrieve the chart functions to run
+    funcs = select_charts(args.charts)
+
+    # If only the names are requested
+    if args.list and not args.compare:
+        print('\n'.join(func.__name__ for func in funcs))
+        return
+
+    # Stop if nothing matches
+    if not funcs and not args.compare:
+        parser.error('no chart functions match %s' % ' '.join(args.charts))
+
+    # Start profiling if any profile is requested
+    profiling = args.profile or args.profile_memory or args.profile_json or args.profile_trace
+    if profiling:
+        start_profiling(args.profile_memory)
+
+    # Start cProfile if requested
+    stats = cProfile.Profile() if args.cprofile else None
+    if stats is not None:
+        stats.enable()
+
+    try:
+        # Compare categories interactively, or generate the charts
+        if args.compare:
+            comp_session(args.out, args.top)
+        else:
+            run_charts(funcs, args.workers, args.force, args.dry_run, args.export)
+    finally:
+        # Save the cProfile statistics
+        if stats is not None:
+            stats.disable()
+            stats.dump_stats(args.cprofile)
+
+        # Report the profile
+        if profiling:
+            done = stop_profiling()
+            if args.profile or args.profile_memory:
+                print('\n' + done.summary())
+            if args.profile_json:
+                done.write_json(args.profile_json)
+            if args.profile_trace:
+                done.write_trace(args.profile_trace)
+
+        # Report the memory saved by narrowing the tables read
+        if args.memory:
+            print('\n' + memory_summary())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+import argparse
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import main as app
+
+# Port the server listens on by default
+PORT = 8050
+
+# Number of encoded responses to keep
+RESPONSE_CACHE_SIZE = 256
+
+# Content type of each format the chart data can be returned in
+FORMATS = {'json': 'application/json', 'arrow': 'application/vnd.apache.arrow.stream'}
+
+# Encoded responses, keyed by the version of the data and the request, least recently used first
+responses = OrderedDict()
+
+# Lock that keeps the handler threads from changing the responses at the same time
+responses_lock = threading.Lock()
+
+
+def encode(charts, fmt):
+    # Encode the charts in the requested format
+    if fmt == 'arrow':
+        return app.chart_arrow(charts)
+    return json.dumps(charts).encode()
+
+
+def chart_body(func, name, fmt):
+    # Retrieve the charts of the function
+    charts = app.chart_data(func, name)
+
+    # Report a chart that does not exist
+    if name is not None and not charts:
+        raise LookupError('%s has no chart named %r' % (func.__name__, name))
+
+    return encode(charts, fmt)
+
+
+def get_response(path, build):
+    # Key the response by the data it was built from
+    key = (app.data_version(), path)
+
+    # Return the response if it was already built
+    with responses_lock:
+        if key in responses:
+            responses.move_to_end(key)
+            return responses[key]
+
+    # Build the response and tag it with a hash of its contents
+    body = build()
+    response = body, '"%s"' % hashlib.sha1(body).hexdigest()[:16]
+
+    with responses_lock:
+        responses[key] = response
+        # Drop the least recently used responses
+        while len(responses) > RESPONSE_CACHE_SIZE:
+            responses.popitem(last=False)
+
+    return response
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        parts = url.path.strip('/').split('/')
+
+        # Retrieve the requested format
+        fmt = query.get('format', ['json'])[0]
+        if fmt not in FORMATS:
+            return self.send_error(400, 'Unknown format %r, expected one of %s' % (fmt, ', '.join(FORMATS)))
+        if fmt == 'arrow' and app.feather is None:
+            return self.send_error(501, 'Arrow responses require pyarrow')
+
+        # If the list of chart functions is requested
+        if parts == ['charts']:
+            fmt = 'json'
+            build = lambda: json.dumps(list(app.CHARTS)).encode()
+        # If the charts of a function are requested
+        elif len(parts) == 2 and parts[0] == 'charts' and parts[1] in app.CHARTS:
+            name = query.get('chart', [None])[0]
+            build = lambda: chart_body(app.CHARTS[parts[1]], name, fmt)
+        else:
+            return self.send_error(404, 'Expected /charts or /charts/<function>')
+
+        try:
+            body, etag = get_response(self.path, build)
+        except LookupError as e:
+            return self.send_error(404, str(e))
+        except (OSError, ValueError) as e:
+            return self.send_error(500, str(e))
+
+        # If the client already has this response, tell it so without sending it again
+        if etag in [_.strip() for _ in self.headers.get('If-None-Match', '').split(',')]:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        # Send the response, asking clients to check it is still current before reusing it
+        self.send_response(200)
+        self.send_header('Content-Type', FORMATS[fmt])
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve the data behind each chart over HTTP.')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=PORT, help='port to listen on (default: %d)' % PORT)
+    args = parser.parse_args(argv)
+
+    # Read the counts and format the labels before the first request
+    app.label_table()
+
+    server = ThreadingHTTPServer((args.host, args.port), Handler)
+    print('Serving chart data on http://%s:%d/charts' % server.server_address[:2])
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
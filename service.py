@@ -0,0 +1,260 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import main as app
+
+# Port the service listens on by default
+PORT = 8051
+
+# Total size of the encoded images to keep, in megabytes
+CACHE_MB = 64
+
+# Content type of each format the charts can be rendered in
+FORMATS = {'png': 'image/png', 'fast': 'image/png', 'svg': 'image/svg+xml'}
+
+# Reason phrase of each status the service responds with
+STATUS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+
+class ImageCache:
+    def __init__(self, max_bytes):
+        # Largest total size of the images kept
+        self.max_bytes = max_bytes
+        self.size = 0
+
+        # Encoded images, least recently used first
+        self.images = OrderedDict()
+
+    def get(self, key):
+        # Retrieve the image and mark it as just used
+        data = self.images.get(key)
+        if data is not None:
+            self.images.move_to_end(key)
+        return data
+
+    def put(self, key, data):
+        # Skip images that would not fit on their own
+        if len(data) > self.max_bytes:
+            return
+
+        # Replace any older copy of the image
+        if key in self.images:
+            self.size -= len(self.images.pop(key))
+        self.images[key] = data
+        self.size += len(data)
+
+        # Drop the least recently used images until the rest fit
+        while self.size > self.max_bytes:
+            self.size -= len(self.images.popitem(last=False)[1])
+
+
+class RenderService:
+    def __init__(self, workers=None, max_bytes=CACHE_MB * 2 ** 20):
+        # Number of processes rendering at once
+        self.workers = workers or os.cpu_count() or 1
+        self.pool = None
+
+        # Images already rendered
+        self.cache = ImageCache(max_bytes)
+
+        # Renders in progress, keyed like the images
+        self.pending = {}
+
+        # Requests answered from the cache, by joining a render in progress, or by a new render
+        self.stats = {'requests': 0, 'hits': 0, 'coalesced': 0, 'renders': 0, 'seconds': 0.0}
+
+    async def get(self, key, render, *args):
+        self.stats['requests'] += 1
+
+        # If the image was already rendered, return it
+        data = self.cache.get(key)
+        if data is not None:
+            self.stats['hits'] += 1
+            return data
+
+        # If the same image is being rendered, wait for that render instead of starting another
+        task = self.pending.get(key)
+        if task is not None:
+            self.stats['coalesced'] += 1
+        else:
+            task = asyncio.ensure_future(self.run(key, render, *args))
+            self.pending[key] = task
+            task.add_done_callback(lambda _: self.pending.pop(key, None))
+
+        # Keep a client that goes away from cancelling the render for the others
+        return await asyncio.shield(task)
+
+    async def run(self, key, render, *args):
+        # Start the worker processes the first time something is rendered, from a fresh process rather than a fork
+        # of this one, so they do not hold the open client connections
+        if self.pool is None:
+            method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            self.pool = ProcessPoolExecutor(self.workers, multiprocessing.get_context(method),
+                                            initializer=app.init_worker)
+
+        self.stats['renders'] += 1
+        start = time.perf_counter()
+
+        # Render the image in a worker process
+        data = await asyncio.get_running_loop().run_in_executor(self.pool, render, *args)
+        self.stats['seconds'] += time.perf_counter() - start
+
+        # Keep the image for later requests
+        self.cache.put(key, data)
+        return data
+
+    async def pie(self, name, chart, export='png'):
+        # Render one pie chart of a chart function, such as one province of food_in_prov
+        return await self.get(('pie', app.data_version(), name, chart, export), app.pie_image, name, chart, export)
+
+    async def bar(self, name, selected, top=2, export='png'):
+        # Render a comparison of the selected categories across a chart function
+        selected = tuple(selected)
+        return await self.get(('bar', app.data_version(), name, selected, top, export), app.bar_image, name, selected,
+                              top, export)
+
+    def close(self):
+        # Stop the worker processes
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+
+async def respond(writer, status, body, content_type='text/plain; charset=utf-8'):
+    # Write the status line, headers and body
+    writer.write(('HTTP/1.1 %d %s\r\nContent-Type: %s\r\nContent-Length: %d\r\nConnection: close\r\n\r\n'
+                  % (status, STATUS[status], content_type, len(body))).encode() + body)
+    await writer.drain()
+    writer.close()
+
+
+async def route(service, method, target):
+    # Only images are served
+    if method != 'GET':
+        return 405, b'Only GET is supported'
+
+    url = urlsplit(target)
+    query = parse_qs(url.query)
+    parts = [unquote(_) for _ in url.path.strip('/').split('/')]
+
+    # Retrieve the requested format
+    export = query.get('format', ['png'])[0]
+    if export not in FORMATS:
+        return 400, ('Unknown format %r, expected one of %s' % (export, ', '.join(FORMATS))).encode()
+
+    # If the counts of each request are requested
+    if parts == ['stats']:
+        return 200, json.dumps(dict(service.stats, cached=len(service.cache.images),
+                                    cached_bytes=service.cache.size)).encode(), 'application/json'
+
+    # If a pie chart is requested
+    if len(parts) == 3 and parts[0] == 'pie' and parts[1] in app.CHARTS:
+        data = await service.pie(parts[1], parts[2], export)
+    # If a comparison is requested
+    elif len(parts) == 2 and parts[0] == 'bar' and parts[1] in app.COMPARED and len(query.get('selected', [])) >= 2:
+        # Show at least one row of each category compared
+        top = query.get('top', ['2'])[0]
+        if not top.isdigit() or int(top) < 1:
+            return 400, ('Expected top to be a whole number of at least 1, got %r' % top).encode()
+        data = await service.bar(parts[1], query['selected'], int(top), export)
+    else:
+        return 404, ('Expected /pie/<function>/<chart>, /bar/<function>?selected=...&selected=... with a function '
+                     'among %s, or /stats' % ', '.join(sorted(app.COMPARED))).encode()
+
+    return 200, data, FORMATS[export]
+
+
+async def handle(service, reader, writer):
+    try:
+        # Read the request line and skip the headers
+        method, target, _ = (await reader.readline()).decode('latin-1').split(' ', 2)
+        while (await reader.readline()) not in [b'\r\n', b'\n', b'']:
+            pass
+    except ValueError:
+        return await respond(writer, 400, b'Malformed request')
+
+    try:
+        await respond(writer, *await route(service, method, target))
+    except (LookupError, ValueError) as e:
+        await respond(writer, 404 if isinstance(e, LookupError) else 400, str(e).encode())
+    except Exception as e:
+        await respond(writer, 500, repr(e).encode())
+
+
+async def fetch(host, port, target):
+    # Send a request and read the whole response
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(('GET %s HTTP/1.1\r\nHost: %s\r\nConnection: close\r\n\r\n' % (target, host)).encode())
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+
+    # Split off the status and the body
+    head, _, body = response.partition(b'\r\n\r\n')
+    return int(head.split()[1]), body
+
+
+async def check(host, port, clients):
+    # Pick a chart of a chart function with several charts
+    name = 'food_in_prov'
+    chart = app.chart_data(app.CHARTS[name])[0]['name']
+
+    # Request it from several clients at once
+    start = time.perf_counter()
+    results = await asyncio.gather(*[fetch(host, port, '/pie/%s/%s' % (name, chart)) for _ in range(clients)])
+    print('%d clients requested %s/%s in %.3fs: %s' % (clients, name, chart, time.perf_counter() - start,
+                                                      sorted(set(status for status, _ in results))))
+
+    # Request it once more, which is answered from the cache
+    start = time.perf_counter()
+    await fetch(host, port, '/pie/%s/%s' % (name, chart))
+    print('Requested it again in %.3fs' % (time.perf_counter() - start))
+
+    # Report how the requests were answered
+    print((await fetch(host, port, '/stats'))[1].decode())
+
+
+async def serve(args):
+    service = RenderService(args.workers, args.cache_mb * 2 ** 20)
+    server = await asyncio.start_server(lambda r, w: handle(service, r, w), args.host, args.port)
+
+    try:
+        # If requested, check the service with local clients and stop
+        if args.check:
+            await check(args.host, server.sockets[0].getsockname()[1], args.check)
+            return
+
+        print('Rendering charts on http://%s:%d' % server.sockets[0].getsockname()[:2])
+        await server.serve_forever()
+    finally:
+        server.close()
+        service.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Render charts on demand over HTTP.')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=PORT, help='port to listen on (default: %d)' % PORT)
+    parser.add_argument('-j', '--workers', type=app.positive_int, default=None,
+                        help='number of processes to render with (default: one per core)')
+    parser.add_argument('--cache-mb', type=app.positive_int, default=CACHE_MB,
+                        help='megabytes of rendered images to keep (default: %d)' % CACHE_MB)
+    parser.add_argument('--check', type=int, metavar='CLIENTS',
+                        help='request one chart from this many local clients at once, report and exit')
+    args = parser.parse_args(argv)
+
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()